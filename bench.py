@@ -0,0 +1,280 @@
+# rough benchmarks. run them all with `python bench.py`, or pick some with `python bench.py lex`
+
+import core
+from core import Pair, nil
+from reader import lex, read
+from evaluator import isheval, isheval_file, root, Scope
+import evaluator
+import hamt
+import pvector
+import os
+import tempfile
+import tracemalloc
+import sys
+import time
+
+SAMPLE = '''
+(def map (mfn
+    ([f []] [])
+    ([f x:xs] (f x):(delay (map f xs)))))
+(obj = { baz: 5, meth: (md [a] (add a @baz)) })
+(def heads (fn [x:xs y:ys] [x y]))
+(print (heads [1 2 3] [#foo #bar]))
+'''
+
+def generated_source(megabytes):
+    return SAMPLE * (megabytes * 1024 * 1024 // len(SAMPLE))
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def bench_lex():
+    code = generated_source(4)
+    tokens, seconds = timed(lambda: lex(code))
+    megabytes = len(code) / (1024 * 1024)
+    print('lex: %.1f MB, %d tokens in %.2fs (%.1f MB/s)' % (megabytes, len(tokens), seconds, megabytes / seconds))
+
+def bench_read():
+    code = generated_source(1)
+    forms, seconds = timed(lambda: read(code))
+    print('read: %d top-level forms in %.2fs (%d forms/s)' % (len(forms), seconds, len(forms) / seconds))
+    code = '(' * 10000 + 'a' + ')' * 10000
+    _, seconds = timed(lambda: read(code))
+    print('read: 10000 levels of nesting in %.2fs' % seconds)
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_stream():
+    code = '(def bench-stream (add 1 (add 2 3)))\n' * 20000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.ish')
+        with open(path, 'w') as f:
+            f.write(code)
+        whole = peak_memory(lambda: isheval(open(path).read()))
+        streamed = peak_memory(lambda: isheval_file(path))
+    print('stream: peak memory evaluating %.1f MB of forms: %.1f MB with isheval, %.1f MB with isheval_file' % (
+        len(code) / (1024 * 1024), whole / (1024 * 1024), streamed / (1024 * 1024)))
+
+def bench_memory():
+    cells = 1000000
+    def build():
+        lst = nil
+        for _ in range(cells):
+            lst = Pair(0, lst)
+        return lst
+    tracemalloc.start()
+    lst = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('memory: %d bytes per cons cell in a %d element list' % (size / cells, cells))
+
+def bench_calls():
+    scope = Scope({}, root)
+    isheval('''
+        (def heads (fn [x:xs y:ys] [x y]))
+        (def loop (fn [n] (if (eq n 0) n (do-heads n))))
+        (def do-heads (fn [n] (heads [n n] [n n]) (loop (subtract n 1))))
+        ''', scope)
+    calls = 20000
+    _, seconds = timed(lambda: isheval('(loop %d)' % calls, scope))
+    print('calls: %d iterations of heads in %.2fs (%.1f us each)' % (calls, seconds, seconds / calls * 1e6))
+
+def bench_memo():
+    scope = Scope({}, root)
+    isheval('''
+        (def fib (mfn ([0] 0) ([1] 1) ([n] (add (fib (subtract n 1)) (fib (subtract n 2))))))
+        (def memo-fib (memo (mfn ([0] 0) ([1] 1) ([n] (add (memo-fib (subtract n 1)) (memo-fib (subtract n 2)))))))
+        ''', scope)
+    _, plain = timed(lambda: isheval('(fib 20)', scope))
+    _, memoized = timed(lambda: isheval('(memo-fib 20)', scope))
+    print('memo: (fib 20) in %.3fs, memoized in %.4fs' % (plain, memoized))
+
+def bench_streams():
+    scope = Scope({}, root)
+    elements = 200000
+    code = '(stream-list (drop %d (stream-filter even? (stream-map (fn [x] (add x 1)) (range 0 %d)))))' % (elements // 2 - 1, elements)
+    peak = peak_memory(lambda: isheval(code, scope))
+    _, seconds = timed(lambda: isheval(code, scope))
+    print('streams: mapped and filtered %d elements in %.2fs, peak memory %.1f KB' % (elements, seconds, peak / 1024))
+
+def bench_methods():
+    scope = Scope({}, root)
+    obj = isheval('{ step: 1, next: (md [n] (subtract n @step)) }', scope)
+    for _ in range(3):
+        obj = core.Object(obj)
+    scope.set('obj', obj)
+    isheval('''
+        (def loop (fn [o n] (if (eq n 0) n (loop o (o.next n)))))
+        ''', scope)
+    calls = 20000
+    _, seconds = timed(lambda: isheval('(loop obj %d)' % calls, scope))
+    print('methods: %d calls through a 4 level prototype chain in %.2fs (%.1f us each)' % (calls, seconds, seconds / calls * 1e6))
+
+def bench_globals():
+    scope = root
+    for _ in range(50):
+        scope = Scope({}, scope)
+    isheval('''
+        (def loop (fn [n] (if (eq n 0) n (loop (subtract n (add 0 1))))))
+        ''', scope)
+    calls = 20000
+    _, seconds = timed(lambda: isheval('(loop %d)' % calls, scope))
+    print('globals: %d iterations, 50 scopes below root, in %.2fs (%.1f us each)' % (calls, seconds, seconds / calls * 1e6))
+
+def bench_folding():
+    scope = Scope({}, root)
+    isheval('''
+        (def table (fn [n] [[n (add 60 (add 60 (add 60 60)))] [#minute 60] [#week (add 86400 (add 86400 (add 86400 (add 86400 86400))))]]))
+        (def loop (fn [n] (if (eq n 0) n (do-table n))))
+        (def do-table (fn [n] (table n) (loop (subtract n 1))))
+        ''', scope)
+    calls = 20000
+    _, seconds = timed(lambda: isheval('(loop %d)' % calls, scope))
+    print('folding: %d iterations building a constant table in %.2fs (%.1f us each)' % (calls, seconds, seconds / calls * 1e6))
+
+def bench_binding():
+    program = '''
+        (def pick (fn [a b c=0] b))
+        (def loop (fn [n] (if (eq n 0) n (loop (pick n (subtract n 1) n)))))
+        '''
+    calls = 20000
+    scope = Scope({}, root)
+    isheval(program, scope)
+    _, seconds = timed(lambda: isheval('(loop %d)' % calls, scope))
+    print('binding: %d calls with three arguments in %.2fs (%.1f us each)' % (calls, seconds, seconds / calls * 1e6))
+
+def bench_lists():
+    length = 1000000
+    def build():
+        lst = nil
+        for i in range(length - 1, -1, -1):
+            lst = Pair(i, lst)
+        return lst
+    scope = Scope({'a': build(), 'b': build()}, root)
+    _, equal_seconds = timed(lambda: isheval('(eq a b)', scope))
+    _, apply_seconds = timed(lambda: isheval('(apply list a)', scope))
+    _, repr_seconds = timed(lambda: repr(scope.get('a')))
+    with open(os.devnull, 'w') as devnull:
+        _, write_seconds = timed(lambda: scope.get('a').write(devnull))
+    print('lists: %d elements: eq in %.2fs, applied in %.2fs, repr in %.2fs, written to a file in %.2fs' % (
+        length, equal_seconds, apply_seconds, repr_seconds, write_seconds))
+
+def bench_dictionaries():
+    size = 20000
+    steps = 200
+    data = hamt.from_items((i, i) for i in range(size))
+    def snapshots():
+        versions = [data]
+        for i in range(steps):
+            versions.append(versions[-1].assoc(i, -i))
+        return versions
+    def copies():
+        versions = [dict((i, i) for i in range(size))]
+        for i in range(steps):
+            version = dict(versions[-1])
+            version[i] = -i
+            versions.append(version)
+        return versions
+    _, hamt_seconds = timed(snapshots)
+    hamt_peak = peak_memory(snapshots)
+    _, dict_seconds = timed(copies)
+    dict_peak = peak_memory(copies)
+    print('dictionaries: %d snapshots of %d entries: %.2fs, %.1f MB with assoc, %.2fs, %.1f MB copying dicts' % (
+        steps, size, hamt_seconds, hamt_peak / (1024 * 1024), dict_seconds, dict_peak / (1024 * 1024)))
+
+def bench_vectors():
+    size = 100000
+    updates = 1000
+    _, transient_seconds = timed(lambda: pvector.from_iterable(range(size)))
+    def appends():
+        vector = pvector.EMPTY_VECTOR
+        for i in range(size):
+            vector = vector.append(i)
+        return vector
+    vector, append_seconds = timed(appends)
+    def assocs():
+        result = vector
+        for i in range(updates):
+            result = result.assoc(i * 97 % size, -i)
+        return result
+    _, assoc_seconds = timed(assocs)
+    print('vectors: %d elements built in %.3fs with a transient, %.3fs appending; %d updates in the middle in %.3fs' % (
+        size, transient_seconds, append_seconds, updates, assoc_seconds))
+
+def bench_frames():
+    program = '''
+        (def small? (fn [n] (eq (subtract n 1) 0)))
+        (def loop (fn [n] (small? n) (if (eq n 0) n (loop (subtract n 1)))))
+        '''
+    calls = 20000
+    created = [0]
+    original_init = evaluator.Frame.__init__
+    def counting_init(frame, layout, parent):
+        created[0] += 1
+        original_init(frame, layout, parent)
+    pool_size = evaluator.FRAME_POOL_SIZE
+    evaluator.Frame.__init__ = counting_init
+    try:
+        for label, size in (('pooled', pool_size), ('unpooled', 0)):
+            evaluator.FRAME_POOL_SIZE = size
+            scope = Scope({}, root)
+            isheval(program, scope)
+            created[0] = 0
+            _, seconds = timed(lambda: isheval('(loop %d)' % calls, scope))
+            print('frames: %s: %.2f frames allocated per call, %.1f us per iteration' % (
+                label, created[0] / (calls * 2), seconds / calls * 1e6))
+    finally:
+        evaluator.Frame.__init__ = original_init
+        evaluator.FRAME_POOL_SIZE = pool_size
+
+def bench_files():
+    lines = 200000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'lines.txt')
+        scope = Scope({'path': path}, root)
+        _, write_seconds = timed(lambda: isheval('(write-lines path (range 0 %d))' % lines, scope))
+        code = '(drop %d (read-lines path))' % lines
+        _, read_seconds = timed(lambda: isheval(code, scope))
+        streamed = peak_memory(lambda: isheval(code, scope))
+        def glue():
+            # what getting the lines in from python used to look like
+            data = nil
+            with open(path) as f:
+                for line in reversed(f.read().splitlines()):
+                    data = Pair(line, data)
+            scope.set('data', data)
+            isheval('(drop %d data)' % lines, scope)
+        listed = peak_memory(glue)
+    print('files: %d lines written in %.2fs, streamed back in %.2fs; peak memory %.1f KB streaming, %.1f MB as a list' % (
+        lines, write_seconds, read_seconds, streamed / 1024, listed / (1024 * 1024)))
+
+BENCHMARKS = {
+    'lex': bench_lex,
+    'read': bench_read,
+    'stream': bench_stream,
+    'memory': bench_memory,
+    'calls': bench_calls,
+    'memo': bench_memo,
+    'streams': bench_streams,
+    'methods': bench_methods,
+    'globals': bench_globals,
+    'folding': bench_folding,
+    'binding': bench_binding,
+    'lists': bench_lists,
+    'dictionaries': bench_dictionaries,
+    'vectors': bench_vectors,
+    'frames': bench_frames,
+    'files': bench_files,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -1,3 +1,8 @@
+from hamt import EMPTY_MAP
+from pvector import EMPTY_VECTOR
+from itertools import islice
+import weakref
+
 nil = None
 class Nil:
     def __init__(self):
@@ -7,6 +12,8 @@ class Nil:
         return 'nil'
     def __eq__(self, other):
         return self is other
+    def __hash__(self):
+        return id(self)
 nil = Nil()
 void = None
 
@@ -17,17 +24,46 @@ def _call(obj, arg, invoking_scope):
         return obj.call(arg, invoking_scope)
 
 class Pair:
+    __slots__ = ('car', 'cdr')
     def __init__(self, car, cdr):
         self.car = car
         self.cdr = cdr
     def call(self, arg, invoking_scope):
         return _call(self.car, Pair(_call(self.cdr, arg, invoking_scope), nil), invoking_scope)
     def __eq__(self, other):
-        return type(other) is Pair and self.car == other.car and self.cdr == other.cdr
+        # only the cars are compared recursively, so long lists don't blow the stack
+        pair = self
+        while type(pair) is Pair:
+            if type(other) is not Pair or not pair.car == other.car:
+                return False
+            pair = pair.cdr
+            other = other.cdr
+        return pair == other
+    def __hash__(self):
+        # structural, to match __eq__. walks the cdrs in a loop so long lists don't recurse
+        cars = []
+        pair = self
+        while type(pair) is Pair:
+            cars.append(pair.car)
+            pair = pair.cdr
+        result = hash(pair)
+        for car in reversed(cars):
+            result = hash((car, result))
+        return result
     def __repr__(self):
-        return '(Pair %s %s)' % (repr(self.car), repr(self.cdr))
+        return ''.join(_pair_chunks(self, repr))
     def __str__(self):
-        return "(Pair %s %s)" % (str(self.car), str(self.cdr))
+        return ''.join(_pair_chunks(self, str))
+    # writes str(self) (or whatever format gives) to a file object a piece at a time, rather
+    # than building the whole string first
+    def write(self, file, format = str):
+        chunks = []
+        for chunk in _pair_chunks(self, format):
+            chunks.append(chunk)
+            if len(chunks) == 4096:
+                file.write(''.join(chunks))
+                chunks.clear()
+        file.write(''.join(chunks))
     def get(self, arg, scope):
         assert type(arg) is Pair
         assert eval_node(arg.cdr, scope) is nil
@@ -46,29 +82,96 @@ class Pair:
         else:
             raise Exception("Pair has no property %s" % identifier)
 
+def _pair_chunks(pair, format):
+    # (Pair a (Pair b nil)), walking the cdrs in a loop
+    depth = 0
+    while type(pair) is Pair:
+        yield '(Pair '
+        yield format(pair.car)
+        yield ' '
+        pair = pair.cdr
+        depth += 1
+    yield format(pair)
+    yield ')' * depth
+
+# Symbols are interned: there's only ever one Symbol with a given name, so they can use the
+# default identity-based __eq__ and __hash__.
 class Symbol:
-    def __init__(self, value):
+    __slots__ = ('value', '__weakref__')
+    # weak, so a symbol nothing uses any more doesn't stay in the table forever. while anything
+    # holds on to a symbol, its name still maps to that one object
+    table = weakref.WeakValueDictionary()
+    def __new__(cls, value):
         assert type(value) is str
-        self.value = value
-    def __eq__(self, other):
-        return type(other) is Symbol and self.value == other.value
+        symbol = Symbol.table.get(value)
+        if symbol is None:
+            symbol = super().__new__(cls)
+            symbol.value = value
+            Symbol.table[value] = symbol
+        return symbol
     def __repr__(self):
         return "#%s" % self.value
-    def __hash__(self):
-        return hash(self.value)
+
+# Objects don't keep their slots in a dict of their own. Instead they share Shapes: an object
+# has a list of values and a shape that says which slot is at which position in it. Objects
+# with the same prototype that had the same slots added in the same order have the same shape,
+# and adding a slot moves an object on to the next shape along, so a shape is enough to know
+# where (and whether) a slot is without looking at the object. See SlotCache.
+class Shape:
+    __slots__ = ('proto', 'slots', 'transitions')
+    # bumped whenever an object that's the prototype of some shape gets a new slot, since that
+    # can change where lookups through the prototype chain end up
+    proto_version = 0
+    def __init__(self, proto, slots):
+        self.proto = proto
+        self.slots = slots
+        self.transitions = {}
+    def with_slot(self, slot):
+        shape = self.transitions.get(slot)
+        if shape is None:
+            slots = dict(self.slots)
+            slots[slot] = len(slots)
+            shape = Shape(self.proto, slots)
+            self.transitions[slot] = shape
+        return shape
 
 class Object:
-    def __init__(self):
-        self.dict = {}
-        self.proto = void
+    def __init__(self, proto = void):
+        self.proto = proto
+        if proto is void:
+            self.shape = EMPTY_SHAPE
+        else:
+            if proto.derived_shape is None:
+                proto.derived_shape = Shape(proto, {})
+            self.shape = proto.derived_shape
+        self.values = []
+        # the shape that objects with this one as their prototype start out with
+        self.derived_shape = None
+    # a fresh dict of the object's own slots, built from its shape; nothing to write through
+    def slot_dict(self):
+        return {slot: self.values[index] for slot, index in self.shape.slots.items()}
+    # returns the object along the prototype chain that has the slot, and its index there
+    def find_slot(self, slot):
+        obj = self
+        while obj is not void:
+            index = obj.shape.slots.get(slot)
+            if index is not None:
+                return obj, index
+            obj = obj.proto
+        raise Exception("could not access slot %s" % slot)
     def get_slot(self, slot):
         assert type(slot) is str
-        if slot in self.dict:
-            return self.dict[slot]
-        elif self.proto is void:
-            raise Exception("could not access slot %s" % slot)
-        else:
-            return self.proto.get_slot(slot)
+        obj, index = self.find_slot(slot)
+        return obj.values[index]
+    def set_slot(self, slot, value):
+        index = self.shape.slots.get(slot)
+        if index is not None:
+            self.values[index] = value
+            return
+        self.shape = self.shape.with_slot(slot)
+        self.values.append(value)
+        if self.derived_shape is not None:
+            Shape.proto_version += 1
     def get(self, arg, scope):
         assert type(arg) is Pair
         assert eval_node(arg.cdr, scope) is nil
@@ -86,23 +189,52 @@ class Object:
         key_node = arg.car
         assert type(key_node) is IdentifierNode # TODO: maybe allow something else
         value = eval_node(arg.cdr.car, scope)
-        self.dict[key_node.identifier] = value
+        self.set_slot(key_node.identifier, value)
     def __eq__(self, other):
         return self is other
+    def __hash__(self):
+        return id(self)
     def __repr__(self):
-        if len(self.dict) == 0:
+        if len(self.values) == 0:
             return '{}'
-        return '{ %s }' % ', '.join(['%s: %s' % (key, repr(value)) for key, value in self.dict.items()])
+        return '{ %s }' % ', '.join(['%s: %s' % (key, repr(value)) for key, value in self.slot_dict().items()])
+
+EMPTY_SHAPE = Shape(void, {})
+
+# An inline cache for looking one slot up on plain Objects, kept by a call site. It remembers
+# where the slot was found for the last shape it saw: on the object itself, or on some object
+# along its prototype chain, which stays right for as long as no prototype gains a new slot.
+class SlotCache:
+    __slots__ = ('slot', 'shape', 'holder', 'index', 'proto_version')
+    def __init__(self, slot):
+        self.slot = slot
+        self.shape = None
+    def lookup(self, obj):
+        if obj.shape is self.shape:
+            holder = self.holder
+            if holder is None:
+                return obj.values[self.index]
+            if self.proto_version == Shape.proto_version:
+                return holder.values[self.index]
+        holder, index = obj.find_slot(self.slot)
+        self.shape = obj.shape
+        self.holder = None if holder is obj else holder
+        self.index = index
+        self.proto_version = Shape.proto_version
+        return holder.values[index]
 
+# The entries live in a PersistentMap (see hamt.py), so assoc and dissoc make new dictionaries
+# that share structure with this one, and a snapshot is just another reference to data. The
+# entries can't be changed in place, since dictionaries hash by them. Identifier keys are slots.
 class Dictionary(Object):
-    def __init__(self):
+    def __init__(self, data = EMPTY_MAP):
         super().__init__()
-        self.data = {}
+        self.data = data
     def get(self, arg, scope):
         assert type(arg) is Pair
         key_node = arg.car
         if type(key_node) is IdentifierNode:
-            super().get(arg, scope)
+            return super().get(arg, scope)
 
         assert eval_node(arg.cdr, scope) is nil
         return self.data[eval_node(key_node, scope)]
@@ -110,29 +242,199 @@ class Dictionary(Object):
         assert type(arg) is Pair
         key_node = arg.car
         if type(key_node) is IdentifierNode:
-            super().set(arg, scope)
-        assert type(arg.cdr) is Pair
-        assert eval_node(arg.cdr.cdr, scope) is nil
-        self.data[eval_node(key_node, scope)] = eval_node(arg.cdr.car, scope)
+            return super().set(arg, scope)
+        raise Exception("dictionaries are immutable. use assoc to make an updated copy")
+    def assoc(self, key, value):
+        return Dictionary(self.data.assoc(key, value))
+    def dissoc(self, key):
+        return Dictionary(self.data.dissoc(key))
+    # equal when the entries are; slots don't count
     def __eq__(self, other):
-        return self is other
+        return type(other) is Dictionary and self.data == other.data
+    def __hash__(self):
+        return hash(self.data)
     def __repr__(self):
         if len(self.data) == 0:
             return '#{}'
         return '#{ %s }' % ', '.join(['%s: %s' % (repr(key), repr(value)) for key, value in self.data.items()])
 
+# A contiguous, mutable sequence. Identifier keys are still slots (apart from length, which
+# every array has), anything else is evaluated as an index. start is where this array begins in
+# items: the rest of a destructured array is a view of the same list, like Vector's. Arrays that
+# share a list are marked shared, and the first change to one copies its part of the list, so
+# changing an array never changes another.
+class Array(Object):
+    def __init__(self, items, start = 0, shared = False):
+        super().__init__()
+        assert type(items) is list
+        self.items = items
+        self.start = start
+        self.shared = shared
+    def __len__(self):
+        return len(self.items) - self.start
+    def _position(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('array index out of range')
+        return self.start + index
+    def __getitem__(self, index):
+        return self.items[self._position(index)]
+    def __iter__(self):
+        if self.start == 0:
+            return iter(self.items)
+        return islice(self.items, self.start, None)
+    def drop(self, count):
+        self.shared = True
+        return Array(self.items, self.start + count, True)
+    def _own_items(self):
+        if self.shared:
+            self.items = self.items[self.start:]
+            self.start = 0
+            self.shared = False
+    def append(self, value):
+        self._own_items()
+        self.items.append(value)
+    def get(self, arg, scope):
+        assert type(arg) is Pair
+        key_node = arg.car
+        if type(key_node) is IdentifierNode:
+            if key_node.identifier == 'length':
+                assert eval_node(arg.cdr, scope) is nil
+                return len(self)
+            return super().get(arg, scope)
+
+        assert eval_node(arg.cdr, scope) is nil
+        index = eval_node(key_node, scope)
+        assert type(index) is int
+        return self[index]
+    def set(self, arg, scope):
+        assert type(arg) is Pair
+        key_node = arg.car
+        if type(key_node) is IdentifierNode:
+            return super().set(arg, scope)
+        assert type(arg.cdr) is Pair
+        assert eval_node(arg.cdr.cdr, scope) is nil
+        index = eval_node(key_node, scope)
+        assert type(index) is int
+        value = eval_node(arg.cdr.car, scope)
+        self._own_items()
+        self.items[self._position(index)] = value
+    def __eq__(self, other):
+        if type(other) is not Array:
+            return False
+        if self.start == 0 and other.start == 0:
+            return self.items == other.items
+        return len(self) == len(other) and all(a is b or a == b for a, b in zip(self, other))
+    def __repr__(self):
+        return '#[%s]' % ' '.join([repr(item) for item in self])
+
+# An immutable indexed sequence over a PersistentVector (see pvector.py): assoc and append make
+# new vectors that share structure with this one. start is where this vector begins in data, so
+# the rest of a destructured vector is another view of the same data rather than a copy.
+class Vector(Object):
+    def __init__(self, data = EMPTY_VECTOR, start = 0):
+        super().__init__()
+        self.data = data
+        self.start = start
+    def __len__(self):
+        return len(self.data) - self.start
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('vector index out of range')
+        return self.data[self.start + index]
+    def __iter__(self):
+        if self.start == 0:
+            return iter(self.data)
+        return (self.data[index] for index in range(self.start, len(self.data)))
+    def drop(self, count):
+        return Vector(self.data, self.start + count)
+    def assoc(self, index, value):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index <= len(self):
+            raise IndexError('vector index out of range')
+        return Vector(self.data.assoc(self.start + index, value), self.start)
+    def append(self, value):
+        return Vector(self.data.append(value), self.start)
+    def get(self, arg, scope):
+        assert type(arg) is Pair
+        key_node = arg.car
+        if type(key_node) is IdentifierNode:
+            if key_node.identifier == 'length':
+                assert eval_node(arg.cdr, scope) is nil
+                return len(self)
+            return super().get(arg, scope)
+
+        assert eval_node(arg.cdr, scope) is nil
+        index = eval_node(key_node, scope)
+        assert type(index) is int
+        return self[index]
+    def set(self, arg, scope):
+        assert type(arg) is Pair
+        if type(arg.car) is IdentifierNode:
+            return super().set(arg, scope)
+        raise Exception("vectors are immutable. use assoc to make an updated copy")
+    def __eq__(self, other):
+        return type(other) is Vector and len(self) == len(other) and all(a is b or a == b for a, b in zip(self, other))
+    def __hash__(self):
+        return hash(tuple(self))
+    def __repr__(self):
+        return '(vector%s)' % ''.join([' ' + repr(item) for item in self])
+
 class Promise:
+    __slots__ = ('node', 'scope', 'thunk', 'value', 'forced')
     def __init__(self, arg, scope):
         assert type(arg) is Pair
         assert eval_node(arg.cdr, scope) is nil
         self.node = arg.car
         self.scope = scope
+        self.thunk = None
+        self.value = void
+        self.forced = False
+    # a promise computed by a python function rather than an ishlisp expression
+    @classmethod
+    def lazy(cls, thunk):
+        promise = cls.__new__(cls)
+        promise.node = None
+        promise.scope = None
+        promise.thunk = thunk
+        promise.value = void
+        promise.forced = False
+        return promise
     def get_value(self):
-        if 'value' not in self.__dict__:
-            self.value = eval_node(self.node, self.scope)
-            del self.node
-            del self.scope
-        return self.value
+        # a promise whose value is another promise takes on that promise's value. chains of
+        # them are forced in a loop rather than recursively, and every promise along the way
+        # remembers the final value
+        promise = self
+        pending = set()
+        while not promise.forced:
+            if promise in pending:
+                raise Exception('a promise depends on its own value')
+            value = promise.value
+            if type(value) is not Promise:
+                if promise.thunk is not None:
+                    value = promise.thunk()
+                else:
+                    value = eval_node(promise.node, promise.scope)
+                # a promise that's been evaluated holds on to the next one in the chain, so that
+                # if a later one raises, forcing this one again carries on from there
+                promise.value = value
+                promise.node = None
+                promise.scope = None
+                promise.thunk = None
+            pending.add(promise)
+            if type(value) is not Promise:
+                break
+            promise = value
+        else:
+            value = promise.value
+        for promise in pending:
+            promise.value = value
+            promise.forced = True
+        return value
 
 from reader import Node, IdentifierNode
 from types import FunctionType
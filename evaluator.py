@@ -1,12 +1,21 @@
-from core import Pair, nil, Symbol, void
-from reader import read, FormNode, IdentifierNode, NumericLiteralNode, ValueNode, Node, SymbolLiteralNode
+from core import Pair, nil, Symbol, void, Object, SlotCache
+from reader import read, read_iter, read_file, FormNode, IdentifierNode, NumericLiteralNode, ValueNode, Node, SymbolLiteralNode, FoldedNode
 from types import FunctionType
+from collections import OrderedDict
 import specials
+import re
 
 class Scope:
+    __slots__ = ('dict', 'parent', 'layouts')
+    layout = None
+    # bumped by every set, so that lookups can cache what an identifier resolved to (see
+    # _cached_lookup and _free_lookup) and know when they have to look again
+    version = 0
     def __init__(self, dict, parent):
         self.dict = dict
         self.parent = parent
+        # the layouts of functions defined directly in this scope (see get_layout)
+        self.layouts = None
     def get(self, identifier):
         if identifier in self.dict:
             return self.dict[identifier]
@@ -16,6 +25,7 @@ class Scope:
     def set(self, identifier, value):
         assert type(identifier) is str
         self.dict[identifier] = value
+        Scope.version += 1
     def has(self, identifier):
         assert type(identifier) is str
         return identifier in self.dict
@@ -38,29 +48,443 @@ class Scope:
     def identifiers(self):
         return self.dict.keys()
 
+# marks a frame slot whose identifier hasn't been bound yet
+UNBOUND = object()
+
+class Layout:
+    """The identifiers a function's frames keep in slots, plus the layout (or, at the
+    end of the chain, the plain Scope) that the function was defined in."""
+    def __init__(self, identifiers, parent):
+        self.identifiers = identifiers
+        self.slots = dict((identifier, i) for i, identifier in enumerate(identifiers))
+        self.parent = parent
+        # frames of this layout that can be reused (see release_frame)
+        self.free_frames = []
+        self.unbound_slots = [UNBOUND] * len(identifiers)
+        # the layouts of functions defined in frames of this one (see get_layout)
+        self.layouts = None
+        # how many frames a frame with this layout is from the scope at the end of the chain
+        if type(parent) is Layout:
+            self.frame_count = parent.frame_count + 1
+            self.base = parent.base
+        else:
+            self.frame_count = 1
+            self.base = parent
+    def resolve(self, identifier):
+        depth = 0
+        layout = self
+        while type(layout) is Layout:
+            if identifier in layout.slots:
+                return (depth, layout.slots[identifier])
+            layout = layout.parent
+            depth += 1
+        return None
+
+# interned so that two functions created from the same fn form share a layout. they're kept
+# on the parent, so a scope's layouts (and the frames pooled on them) go away with it
+def get_layout(identifiers, scope):
+    parent = scope.layout or scope
+    if parent.layouts is None:
+        parent.layouts = {}
+    identifiers = tuple(identifiers)
+    layout = parent.layouts.get(identifiers)
+    if layout is None:
+        layout = parent.layouts[identifiers] = Layout(identifiers, parent)
+    return layout
+
+class Frame(Scope):
+    """A function call's scope. Identifiers from the function's layout live in a list of
+    slots; anything else (def-ed at runtime, say) falls back to the usual dict.
+
+    Once the call is over, a frame nothing else kept hold of goes back to its layout to be
+    reused by a later call. Closures, promises and streams made in a frame mark it captured."""
+    __slots__ = ('layout', 'slots', 'captured')
+    def __init__(self, layout, parent):
+        super().__init__({}, parent)
+        self.layout = layout
+        self.slots = [UNBOUND] * len(layout.identifiers)
+        self.captured = False
+    def get(self, identifier):
+        slot = self.layout.slots.get(identifier)
+        if slot is not None:
+            value = self.slots[slot]
+            if value is not UNBOUND:
+                return value
+        elif identifier in self.dict:
+            return self.dict[identifier]
+        if self.parent is void:
+            raise Exception("identifier '%s' is not in scope" % identifier)
+        return self.parent.get(identifier)
+    def set(self, identifier, value):
+        assert type(identifier) is str
+        slot = self.layout.slots.get(identifier)
+        if slot is None:
+            self.dict[identifier] = value
+        else:
+            self.slots[slot] = value
+    def has(self, identifier):
+        assert type(identifier) is str
+        slot = self.layout.slots.get(identifier)
+        if slot is None:
+            return identifier in self.dict
+        return self.slots[slot] is not UNBOUND
+    def identifiers(self):
+        return set(identifier for identifier, value in zip(self.layout.identifiers, self.slots) if value is not UNBOUND) | self.dict.keys()
+
+# how many released frames each layout keeps around. enough for a few calls deep of the same
+# function; deep recursion just makes new ones
+FRAME_POOL_SIZE = 16
+
+def new_frame(layout, parent):
+    free = layout.free_frames
+    if free:
+        frame = free.pop()
+        frame.parent = parent
+        return frame
+    return Frame(layout, parent)
+
+def release_frame(frame):
+    if frame.captured:
+        return
+    free = frame.layout.free_frames
+    if len(free) < FRAME_POOL_SIZE:
+        frame.slots[:] = frame.layout.unbound_slots
+        if frame.dict:
+            frame.dict = {}
+        frame.parent = void
+        free.append(frame)
+
+# for anything that keeps a reference to a scope beyond the call it was evaluated in
+def capture(scope):
+    while scope is not void:
+        if type(scope) is Frame:
+            scope.captured = True
+            return
+        scope = scope.parent
+
+def _leave_frame(frame, val):
+    # a TailCall still needs the frame to evaluate its argument in, so finish_tail_calls
+    # releases it once it has
+    if type(val) is not TailCall or val.scope is not frame:
+        release_frame(frame)
+    return val
+
+def _addressed_lookup(identifier, layout, depth, slot):
+    # Only valid when evaluated in a frame with the layout the address was resolved against.
+    # If any frame we skip over has picked up extra identifiers at runtime, one of them might
+    # shadow ours, so we take the named path instead.
+    if depth == 0:
+        def code(scope):
+            if scope.layout is layout:
+                value = scope.slots[slot]
+                if value is not UNBOUND:
+                    return value
+            return scope.get(identifier)
+    else:
+        def code(scope):
+            if scope.layout is layout:
+                frame = scope
+                for _ in range(depth):
+                    if frame.dict:
+                        return scope.get(identifier)
+                    frame = frame.parent
+                value = frame.slots[slot]
+                if value is not UNBOUND:
+                    return value
+            return scope.get(identifier)
+    return code
+
+# frames write their slots without going through set, so a scope chain with a frame anywhere
+# in it can change without Scope.version noticing
+def _is_versioned(scope):
+    while scope is not void:
+        if scope.layout is not None:
+            return False
+        scope = scope.parent
+    return True
+
+def _cached_lookup(identifier):
+    # remembers the value for the last scope it was evaluated in. good for top-level code,
+    # which keeps being evaluated in the same scope
+    cached_scope = None
+    cached_version = -1
+    cached_value = None
+    def code(scope):
+        nonlocal cached_scope, cached_version, cached_value
+        if scope is cached_scope and cached_version == Scope.version:
+            return cached_value
+        value = scope.get(identifier)
+        if _is_versioned(scope):
+            cached_scope = scope
+            cached_version = Scope.version
+            cached_value = value
+        return value
+    return code
+
+def _free_lookup(identifier, layout):
+    # an identifier in a function body that none of the enclosing layouts bind: unless a
+    # frame in between has picked it up at runtime, it comes from the layout chain's base
+    # scope, where its value can be cached until the next set
+    base = layout.base
+    if not _is_versioned(base):
+        return lambda scope: scope.get(identifier)
+    frame_count = layout.frame_count
+    cached_version = -1
+    cached_value = None
+    def code(scope):
+        nonlocal cached_version, cached_value
+        if scope.layout is not layout:
+            return scope.get(identifier)
+        frame = scope
+        for _ in range(frame_count):
+            if identifier in frame.dict:
+                return frame.dict[identifier]
+            frame = frame.parent
+        if cached_version != Scope.version:
+            cached_value = base.get(identifier)
+            cached_version = Scope.version
+        return cached_value
+    return code
+
+BINDER_IDENTIFIERS = set(['fn', 'function', 'md', 'method', 'mfn', 'multi-function'])
+
+def resolve_identifiers(forms, layout):
+    """Gives every identifier in forms that's bound by layout (or a layout it's nested in)
+    a (depth, slot) address. Doesn't descend into nested function literals: they get
+    resolved against their own layout when they're created."""
+    stack = [forms]
+    while stack:
+        node = stack.pop()
+        if type(node) is IdentifierNode:
+            address = layout.resolve(node.identifier)
+            if address is not None:
+                node.code = _addressed_lookup(node.identifier, layout, *address)
+            else:
+                node.code = _free_lookup(node.identifier, layout)
+        elif type(node) is Pair or type(node) is FormNode:
+            if type(node) is FormNode and _is_binder(node.car):
+                continue
+            stack.append(node.cdr)
+            stack.append(node.car)
+        elif type(node) is FoldedNode:
+            stack.append(node.form)
+
+def _is_binder(node):
+    if type(node) is IdentifierNode:
+        return node.identifier in BINDER_IDENTIFIERS
+    return type(node) is ValueNode and node.value is specials.function_shorthand
+
+def _numbered_identifiers(forms):
+    identifiers = []
+    stack = [forms]
+    while stack:
+        node = stack.pop()
+        if type(node) is IdentifierNode and re.match(r'^-\d+$', node.identifier):
+            identifiers.append(node.identifier)
+        elif type(node) is Pair or type(node) is FormNode:
+            stack.append(node.cdr)
+            stack.append(node.car)
+        elif type(node) is FoldedNode:
+            stack.append(node.form)
+    return identifiers
+
+# builtins whose result depends only on their arguments, so a call with constant arguments can
+# be worked out before it's evaluated
+PURE_BUILTINS = {
+    'add': specials.add,
+    'subtract': specials.subtract,
+    'eq': specials.eq,
+    'even?': specials.even,
+    'odd?': specials.odd,
+    'cons': specials.cons,
+    'list': specials.list_,
+}
+
+def _is_constant(node):
+    return type(node) is NumericLiteralNode or type(node) is SymbolLiteralNode or type(node) is FoldedNode
+
+def _constant_node(node):
+    # the builtins get their argument nodes, so they're passed nodes in the same shape
+    if type(node) is FoldedNode:
+        return ValueNode('_constant', node.value)
+    return ValueNode('_constant', compile_node(node)(None))
+
+def fold_form(form):
+    """Returns a FoldedNode for form if it's a call to a pure builtin with constant arguments
+    (literals, or forms that have already been folded), otherwise None."""
+    head = form.car
+    if type(head) is IdentifierNode:
+        special = PURE_BUILTINS.get(head.identifier)
+        guards = ((head, special),)
+    elif type(head) is ValueNode and head.value in PURE_BUILTINS.values():
+        special = head.value
+        guards = ()
+    else:
+        return None
+    if special is None:
+        return None
+    items = []
+    arg = form.cdr
+    while type(arg) is Pair:
+        if not _is_constant(arg.car):
+            return None
+        items.append(_constant_node(arg.car))
+        guards += arg.car.guards if type(arg.car) is FoldedNode else ()
+        arg = arg.cdr
+    if arg is not nil:
+        if not _is_constant(arg):
+            return None
+        constant_arg = _constant_node(arg)
+        guards += arg.guards if type(arg) is FoldedNode else ()
+    else:
+        constant_arg = nil
+    for item in reversed(items):
+        constant_arg = Pair(item, constant_arg)
+    try:
+        value = special(constant_arg, None)
+    except Exception:
+        # (add 1 #foo), say. leave it to fail when it's evaluated
+        return None
+    return FoldedNode(form, value, guards)
+
+def fold_constants(node):
+    """Replaces the forms in node (which is modified in place) that fold_form can work out with
+    FoldedNodes, innermost first, and returns the result."""
+    # collect every form, parents before children, then fold them in the opposite order
+    forms = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if type(current) is FormNode:
+            forms.append(current)
+            stack.append(current.car)
+            stack.append(current.cdr)
+        elif type(current) is Pair:
+            stack.append(current.car)
+            stack.append(current.cdr)
+    folded = {}
+    for form in reversed(forms):
+        if type(form.car) is FormNode and id(form.car) in folded:
+            form.car = folded[id(form.car)]
+        cell = form
+        while type(cell.cdr) is Pair:
+            cell = cell.cdr
+            if type(cell.car) is FormNode and id(cell.car) in folded:
+                cell.car = folded[id(cell.car)]
+        if type(cell.cdr) is FormNode and id(cell.cdr) in folded:
+            cell.cdr = folded[id(cell.cdr)]
+        folded_form = fold_form(form)
+        if folded_form is not None:
+            folded[id(form)] = folded_form
+    if type(node) is FormNode and id(node) in folded:
+        return folded[id(node)]
+    return node
+
+def _pairs(items, tail):
+    for item in reversed(items):
+        tail = Pair(item, tail)
+    return tail
+
+class TailCall:
+    """Returned from a function body whose last form calls another ishlisp function, instead
+    of making the call. Function.call keeps entering these until it gets a real value, so
+    tail calls don't grow the Python stack."""
+    __slots__ = ('fn', 'arg', 'scope')
+    def __init__(self, fn, arg, scope):
+        self.fn = fn
+        self.arg = arg
+        self.scope = scope
+
 class Function:
+    implicit_identifiers = ['-']
     def __init__(self, arg, scope):
         assert type(arg) is Pair
         assert type(arg.cdr) is Pair or arg.cdr is nil
         self.pattern = specials.pattern(arg.car, scope)
         self.forms = arg.cdr
         self.scope = scope
-    def __repr__(self):
-        return "(fn %s %s)" % (self.pattern.nice_repr(), repr(self.forms))
-    def call(self, arg, invoking_scope, initial_scope_contents = None):
-        new_scope = Scope(initial_scope_contents or {}, self.scope)
-        evaled_arg = eval_node(arg, invoking_scope)
-        if not self.pattern.match(evaled_arg, new_scope):
-            raise Exception("pattern did not match. pattern: '%s' actual: '%s'" % (self.pattern.nice_repr(), repr(evaled_arg)))
-        val = void
-        if not new_scope.has('-'):
-            new_scope.set('-', val)
+        capture(scope)
+
+        identifiers = self.pattern.identifiers() + self.implicit_identifiers
+        if type(self.pattern) is DefaultArgumentsPattern:
+            identifiers += _numbered_identifiers(self.forms)
+        self.layout = get_layout(list(dict.fromkeys(identifiers)), scope)
+        self.hyphen_slot = self.layout.slots['-']
+        self.matcher = self.pattern.compile(self.layout)
+        self.items_matcher = self.pattern.compile_items(self.layout)
+        resolve_identifiers(self.forms, self.layout)
+
+        self.body = []
+        self.tail = None
         forms = self.forms
         while forms is not nil:
-            val = eval_node(forms.car, new_scope)
-            new_scope.set('-', val)
+            if forms.cdr is nil:
+                self.tail = compile_tail(forms.car)
+            else:
+                self.body.append(compile_node(forms.car))
             forms = forms.cdr
+    def __repr__(self):
+        return "(fn %s %s)" % (self.pattern.nice_repr(), repr(self.forms))
+    def new_frame(self, arg, invoking_scope, initial_scope_contents = None):
+        if self.items_matcher is None:
+            return self.new_frame_evaluated(eval_node(arg, invoking_scope), initial_scope_contents)
+        # evaluate the arguments into a python list for the pattern, rather than a list of pairs
+        items = []
+        append = items.append
+        while type(arg) is Pair:
+            node = arg.car
+            append((node.code or compile_node(node))(invoking_scope) if isinstance(node, Node) else eval_node(node, invoking_scope))
+            arg = arg.cdr
+        if arg is not nil:
+            # (f a | rest): the tail could be anything, so match the list as usual
+            return self.new_frame_evaluated(_pairs(items, eval_node(arg, invoking_scope)), initial_scope_contents)
+        return self.new_frame_items(items, initial_scope_contents)
+    def new_frame_items(self, items, initial_scope_contents = None):
+        new_scope = new_frame(self.layout, self.scope)
+        if initial_scope_contents is not None:
+            for identifier, value in initial_scope_contents.items():
+                new_scope.set(identifier, value)
+        if not self.items_matcher(items, new_scope):
+            raise PatternMatchError(self.pattern, _pairs(items, nil))
+        return new_scope
+    def new_frame_evaluated(self, evaled_arg, initial_scope_contents = None):
+        new_scope = self.match_frame(evaled_arg, initial_scope_contents)
+        if new_scope is None:
+            raise PatternMatchError(self.pattern, evaled_arg)
+        return new_scope
+    def match_frame(self, evaled_arg, initial_scope_contents = None):
+        # returns None if the pattern doesn't match
+        new_scope = new_frame(self.layout, self.scope)
+        if initial_scope_contents is not None:
+            for identifier, value in initial_scope_contents.items():
+                new_scope.set(identifier, value)
+        if not self.matcher(evaled_arg, new_scope):
+            release_frame(new_scope)
+            return None
+        return new_scope
+    def run_body(self, new_scope):
+        # returns either the value of the last form or a TailCall
+        val = void
+        slots = new_scope.slots
+        hyphen_slot = self.hyphen_slot
+        if slots[hyphen_slot] is UNBOUND:
+            slots[hyphen_slot] = val
+        for code in self.body:
+            val = code(new_scope)
+            slots[hyphen_slot] = val
+        if self.tail is not None:
+            val = self.tail(new_scope)
+            if type(val) is not TailCall:
+                slots[hyphen_slot] = val
         return val
+    def enter(self, arg, invoking_scope, initial_scope_contents = None):
+        frame = self.new_frame(arg, invoking_scope, initial_scope_contents)
+        return _leave_frame(frame, self.run_body(frame))
+    def enter_evaluated(self, evaled_arg, initial_scope_contents = None):
+        frame = self.new_frame_evaluated(evaled_arg, initial_scope_contents)
+        return _leave_frame(frame, self.run_body(frame))
+    def call(self, arg, invoking_scope, initial_scope_contents = None):
+        return finish_tail_calls(self.enter(arg, invoking_scope, initial_scope_contents))
 
 class MultiFunction:
     def __init__(self, arg, scope):
@@ -75,66 +499,339 @@ class MultiFunction:
             # print(function)
 
             arg = arg.cdr
+        self.index = DispatchIndex([func.pattern for func in self.functions])
     def __repr__(self):
         return '(mfn %s)' % ''.join(['(%s %s)' % (func.pattern.nice_repr(), repr(func.forms)) for func in self.functions])
+    def enter(self, arg, invoking_scope):
+        return self.enter_evaluated(eval_node(arg, invoking_scope))
+    def enter_evaluated(self, evaled_arg):
+        # the argument is evaluated once, and only the clauses the index can't rule out get tried
+        functions = self.functions
+        for i in self.index.candidates(evaled_arg):
+            func = functions[i]
+            new_scope = func.match_frame(evaled_arg)
+            if new_scope is not None:
+                return _leave_frame(new_scope, func.run_body(new_scope))
+        raise NoMatchingClauseError(self, evaled_arg)
     def call(self, arg, invoking_scope):
-        for func in self.functions:
-            try:
-                return func.call(arg, invoking_scope)
-            except:
-                pass
-        raise Exception("No pattern matched")
+        return finish_tail_calls(self.enter(arg, invoking_scope))
 
 class Method(Function):
+    implicit_identifiers = ['-', 'this']
     def __repr__(self):
         return "(md %s %s)" % (self.pattern.nice_repr(), repr(self.forms))
     def call(self, arg, invoking_scope):
         raise Exception("an unbound method cannot be invoked")
 
 class BoundMethod:
+    __slots__ = ('method', 'obj')
     def __init__(self, method, obj):
         self.method = method
         self.obj = obj
     def __repr__(self):
         return "(BoundMethod %s %s)" % (repr(self.method), repr(self.obj))
+    def enter(self, arg, invoking_scope):
+        return super(Method, self.method).enter(arg, invoking_scope, {'this': self.obj})
+    def enter_evaluated(self, evaled_arg):
+        return super(Method, self.method).enter_evaluated(evaled_arg, {'this': self.obj})
     def call(self, arg, invoking_scope):
         return super(Method, self.method).call(arg, invoking_scope, {'this': self.obj})
 
-def eval_node(node, scope):
+class Partial:
+    """A callable with its first few arguments already supplied, made by curry. The arguments
+    are evaluated once and kept in a tuple, and every call conses them onto its own arguments,
+    so calls never share or change any state. A partial of a partial is flattened into one."""
+    __slots__ = ('fn', 'arguments', 'reversed_nodes')
+    def __init__(self, fn, arguments):
+        if type(fn) is Partial:
+            arguments = fn.arguments + arguments
+            fn = fn.fn
+        self.fn = fn
+        self.arguments = arguments
+        # builtins take their arguments unevaluated. these get consed on from the last one back
+        self.reversed_nodes = tuple(ValueNode('_curried', argument) for argument in reversed(arguments))
+    def __repr__(self):
+        return "(curry %s)" % ' '.join([repr(self.fn)] + [repr(argument) for argument in self.arguments])
+    def enter(self, arg, invoking_scope):
+        fn = self.fn
+        if type(fn) is FunctionType:
+            for node in self.reversed_nodes:
+                arg = Pair(node, arg)
+            return fn(arg, invoking_scope)
+        return self.enter_evaluated(eval_node(arg, invoking_scope), invoking_scope)
+    def enter_evaluated(self, evaled_arg, invoking_scope = None):
+        fn = self.fn
+        evaled_arg = _pairs(self.arguments, evaled_arg)
+        if type(fn) in TAIL_CALLABLES:
+            return fn.enter_evaluated(evaled_arg)
+        return apply_evaluated(fn, evaled_arg, invoking_scope)
+    def call(self, arg, invoking_scope):
+        if type(self.fn) is FunctionType:
+            # builtins never return a TailCall
+            return self.enter(arg, invoking_scope)
+        return finish_tail_calls(self.enter(arg, invoking_scope))
+
+# the callables that know how to enter a call without finishing it (see TailCall)
+TAIL_CALLABLES = set([Function, MultiFunction, BoundMethod, Partial])
+
+def finish_tail_calls(val):
+    while type(val) is TailCall:
+        scope = val.scope
+        val = val.fn.enter(val.arg, scope)
+        release_frame(scope)
+    return val
+
+# calls any callable with an argument that's already been evaluated, for builtins implemented in python
+def apply_evaluated(fn, evaled_arg, invoking_scope):
+    if type(fn) is FunctionType:
+        return fn(evaled_arg, invoking_scope)
+    elif type(fn) is Partial:
+        return finish_tail_calls(fn.enter_evaluated(evaled_arg, invoking_scope))
+    elif type(fn) in TAIL_CALLABLES:
+        return finish_tail_calls(fn.enter_evaluated(evaled_arg))
+    else:
+        return fn.call(evaled_arg, invoking_scope)
+
+DEFAULT_MEMO_SIZE = 1024
+
+class _MemoKey:
+    # holds an argument with its hash, so the cache hashes a list argument (which walks all of
+    # it) once a call rather than on every lookup
+    __slots__ = ('value', 'hash')
+    def __init__(self, value):
+        self.value = value
+        self.hash = hash(value)
+    def __hash__(self):
+        return self.hash
+    def __eq__(self, other):
+        return self.value == other.value
+
+_MISSING = object()
+
+class Memo:
+    """Caches the results of a callable, keyed on its evaluated argument, keeping the most
+    recently used max_size of them. Arguments that can't be hashed (arrays, say) are passed
+    straight through."""
+    def __init__(self, fn, max_size = DEFAULT_MEMO_SIZE):
+        assert type(max_size) is int and max_size > 0
+        self.fn = fn
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def __repr__(self):
+        return "(memo %s %d)" % (repr(self.fn), self.max_size)
+    def call(self, arg, invoking_scope):
+        evaled_arg = eval_node(arg, invoking_scope)
+        try:
+            key = _MemoKey(evaled_arg)
+        except TypeError:
+            self.misses += 1
+            return apply_evaluated(self.fn, evaled_arg, invoking_scope)
+        cache = self.cache
+        val = cache.get(key, _MISSING)
+        if val is not _MISSING:
+            self.hits += 1
+            cache.move_to_end(key)
+            return val
+        self.misses += 1
+        val = apply_evaluated(self.fn, evaled_arg, invoking_scope)
+        cache[key] = val
+        if len(cache) > self.max_size:
+            cache.popitem(last = False)
+        return val
+    def get(self, arg, scope):
+        assert type(arg) is Pair
+        assert eval_node(arg.cdr, scope) is nil
+        key_node = arg.car
+        assert type(key_node) is IdentifierNode
+        identifier = key_node.identifier
+        if identifier == 'hits':
+            return self.hits
+        elif identifier == 'misses':
+            return self.misses
+        elif identifier == 'size':
+            return len(self.cache)
+        elif identifier == 'max-size':
+            return self.max_size
+        else:
+            raise Exception("memo has no property %s" % identifier)
+
+def compile_node(node):
+    """Turns a node into a closure that evaluates it in a given scope.
+
+    The closure is cached on the node, so the type dispatch, int() parsing and
+    Symbol construction happen once per node instead of once per evaluation."""
     if type(node) is Pair:
-        return Pair(eval_node(node.car, scope), eval_node(node.cdr, scope))
+        return lambda scope: eval_node(node, scope)
 
-    # we're re-evaluating something that's already been evaluated. this might be a terrible idea.
-    # currently used by the apply and curry builtins to pre-apply arguments before calling a built-in function
-    # should just use ValueNodes in all cases
+    # see the note in eval_node about already-evaluated values
     if not isinstance(node, Node):
-        return node
+        return lambda scope: node
+
+    if node.code is not None:
+        return node.code
 
     if type(node) is FormNode:
-        fn = eval_node(node.car, scope)
-        if type(fn) is FunctionType:
-            return fn(node.cdr, scope)
-        else:
-            return fn.call(node.cdr, scope)
+        code = _compile_get(node) if _is_get_site(node) else _compile_form(node)
     elif type(node) is IdentifierNode:
-        return scope.get(node.identifier)
+        code = _cached_lookup(node.identifier)
     elif type(node) is NumericLiteralNode:
-        return int(node.value)
+        value = int(node.value)
+        code = lambda scope: value
     elif type(node) is SymbolLiteralNode:
-        return Symbol(node.value)
+        symbol = Symbol(node.value)
+        code = lambda scope: symbol
     elif type(node) is ValueNode:
-        return node.value
+        value = node.value
+        code = lambda scope: value
+    elif type(node) is FoldedNode:
+        code = _compile_folded(node)
     else:
-        raise Exception("I don't know how to eval %s (%s)" % (str(node), type(node)))
+        def code(scope):
+            raise Exception("I don't know how to eval %s (%s)" % (str(node), type(node)))
+    node.code = code
+    return code
+
+def _compile_folded(node):
+    value = node.value
+    guards = node.guards
+    if not guards:
+        return lambda scope: value
+    form = node.form
+    def code(scope):
+        for head, special in guards:
+            if (head.code or compile_node(head))(scope) is not special:
+                return (form.code or compile_node(form))(scope)
+        return value
+    return code
+
+# obj.key (and @key): a get with a key that's always the same slot, which can keep an inline cache
+def _is_get_site(node):
+    if type(node) is not FormNode or type(node.car) is not ValueNode or node.car.value is not specials.get:
+        return False
+    arg = node.cdr
+    return type(arg) is Pair and type(arg.cdr) is Pair and type(arg.cdr.car) is IdentifierNode and arg.cdr.cdr is nil
+
+def _compile_get(node):
+    receiver = compile_node(node.cdr.car)
+    key_arg = node.cdr.cdr
+    cache = SlotCache(key_arg.car.identifier)
+    def code(scope):
+        obj = receiver(scope)
+        if type(obj) is not Object:
+            return obj.get(key_arg, scope)
+        value = cache.lookup(obj)
+        if type(value) is Method:
+            return BoundMethod(value, obj)
+        return value
+    return code
+
+# (obj.key args): when the slot holds a method, it's called with this bound directly, rather
+# than through a BoundMethod. in tail position the BoundMethod is still needed for the TailCall
+def _compile_method_call(node, tail):
+    receiver = compile_node(node.car.cdr.car)
+    key_arg = node.car.cdr.cdr
+    cache = SlotCache(key_arg.car.identifier)
+    arg = node.cdr
+    def code(scope):
+        obj = receiver(scope)
+        if type(obj) is not Object:
+            fn = obj.get(key_arg, scope)
+        else:
+            fn = cache.lookup(obj)
+            if type(fn) is Method:
+                if tail:
+                    return TailCall(BoundMethod(fn, obj), arg, scope)
+                return Function.call(fn, arg, scope, {'this': obj})
+        if type(fn) is FunctionType:
+            return fn(arg, scope)
+        elif tail and type(fn) in TAIL_CALLABLES:
+            return TailCall(fn, arg, scope)
+        else:
+            return fn.call(arg, scope)
+    return code
+
+def _compile_form(node):
+    if _is_get_site(node.car):
+        return _compile_method_call(node, False)
+    head = compile_node(node.car)
+    arg = node.cdr
+    def code(scope):
+        fn = head(scope)
+        if type(fn) is FunctionType:
+            return fn(arg, scope)
+        else:
+            return fn.call(arg, scope)
+    return code
+
+def compile_tail(node):
+    """Like compile_node, but for a node in tail position: calls to ishlisp functions return
+    a TailCall instead of being made, and ifs pass tail position on to their branches."""
+    if type(node) is not FormNode:
+        return compile_node(node)
+    if node.tail_code is not None:
+        return node.tail_code
+    if _is_get_site(node.car):
+        node.tail_code = _compile_method_call(node, True)
+        return node.tail_code
+
+    head = compile_node(node.car)
+    arg = node.cdr
+    def code(scope):
+        fn = head(scope)
+        if type(fn) is FunctionType:
+            if fn is specials.if_:
+                return compile_tail(specials.if_branch(arg, scope))(scope)
+            return fn(arg, scope)
+        elif type(fn) in TAIL_CALLABLES:
+            return TailCall(fn, arg, scope)
+        else:
+            return fn.call(arg, scope)
+    node.tail_code = code
+    return code
+
+def eval_node(node, scope):
+    if type(node) is Pair:
+        # an argument list. evaluated along the cdrs in a loop, so long ones don't recurse
+        values = []
+        while type(node) is Pair:
+            values.append(eval_node(node.car, scope))
+            node = node.cdr
+        return _pairs(values, eval_node(node, scope))
+
+    # we're re-evaluating something that's already been evaluated. this might be a terrible idea.
+    # currently used by the apply and curry builtins to pre-apply arguments before calling a built-in function
+    # should just use ValueNodes in all cases
+    if not isinstance(node, Node):
+        return node
+
+    return (node.code or compile_node(node))(scope)
 
 root = Scope({
     'print': specials.print_,
+    'read-file': specials.read_file,
+    'read-lines': specials.read_lines,
+    'write-file': specials.write_file,
+    'write-lines': specials.write_lines,
     'add': specials.add,
     'subtract': specials.subtract,
     'delay': specials.delay,
     'force': specials.force,
+    'stream-map': specials.stream_map,
+    'stream-filter': specials.stream_filter,
+    'take': specials.take,
+    'drop': specials.drop,
+    'iterate': specials.iterate,
+    'range': specials.range_,
+    'stream-list': specials.stream_list,
     'id': specials.id,
     'list': specials.list_,
+    'array': specials.array,
+    'vector': specials.vector,
+    'length': specials.length,
+    'slice': specials.slice,
+    'append': specials.append,
     'cons': specials.cons,
     'get': specials.get,
     'get-slot': specials.get_slot,
@@ -155,10 +852,14 @@ root = Scope({
     'call': specials.call,
     'apply': specials.apply,
     'curry': specials.curry,
+    'memo': specials.memo,
     'even?': specials.even,
     'odd?': specials.odd,
     'object': specials.object,
     'dictionary': specials.dictionary,
+    'assoc': specials.assoc,
+    'dissoc': specials.dissoc,
+    'contains?': specials.contains,
     'def': specials.def_,
     'redef': specials.redef,
     'true': True,
@@ -172,7 +873,21 @@ root = Scope({
 def isheval(code, scope = root):
     ret_value = nil
     for node in read(code):
-        ret_value = eval_node(node, scope)
+        ret_value = compile_node(fold_constants(node))(scope)
+    return ret_value
+
+def isheval_stream(file_like, scope = root):
+    """Evaluates each top-level form as soon as it's been read, so only the form being evaluated
+    (and whatever it keeps around) is ever in memory."""
+    ret_value = nil
+    for node in read_iter(file_like):
+        ret_value = compile_node(fold_constants(node))(scope)
+    return ret_value
+
+def isheval_file(path, scope = root):
+    ret_value = nil
+    for node in read_file(path):
+        ret_value = compile_node(fold_constants(node))(scope)
     return ret_value
 
-from patterns import Pattern
+from patterns import Pattern, DefaultArgumentsPattern, DispatchIndex, PatternMatchError, NoMatchingClauseError
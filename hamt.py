@@ -0,0 +1,209 @@
+# A persistent (immutable) hash map: a hash array mapped trie. Each level of the trie uses 5 bits
+# of the key's hash to pick one of up to 32 children, and only stores the children that exist,
+# packed into a tuple and indexed through a bitmap. assoc and dissoc copy the nodes on the path
+# to the key and share everything else with the map they started from, so deriving a modified
+# map costs O(log32 n) rather than a copy of the whole thing.
+#
+# Entries in a node are (key, value, hash) tuples, so hashes (which are O(n) for lists) are
+# computed once per key. Keys whose 64 bit hashes collide end up together in a _CollisionNode.
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+def _hash(key):
+    return hash(key) & HASH_MASK
+
+def _same_key(a, b):
+    return a is b or a == b
+
+def _index(bitmap, bit):
+    return bin(bitmap & (bit - 1)).count('1')
+
+def _replaced(entries, index, entry):
+    return entries[:index] + (entry,) + entries[index + 1:]
+
+def _removed(entries, index):
+    return entries[:index] + entries[index + 1:]
+
+def _pair_node(first, second, shift):
+    # a node holding two entries whose hashes agree below shift
+    if shift >= HASH_BITS:
+        return _CollisionNode((first, second))
+    first_position = (first[2] >> shift) & MASK
+    second_position = (second[2] >> shift) & MASK
+    if first_position == second_position:
+        return _BitmapNode(1 << first_position, (_pair_node(first, second, shift + BITS),))
+    if first_position > second_position:
+        first, second = second, first
+    return _BitmapNode((1 << first_position) | (1 << second_position), (first, second))
+
+class _BitmapNode:
+    __slots__ = ('bitmap', 'entries')
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+    def find(self, key, key_hash, shift):
+        # returns the entry for key, or None
+        node = self
+        while type(node) is _BitmapNode:
+            bit = 1 << ((key_hash >> shift) & MASK)
+            if not node.bitmap & bit:
+                return None
+            entry = node.entries[_index(node.bitmap, bit)]
+            if type(entry) is tuple:
+                return entry if _same_key(entry[0], key) else None
+            node = entry
+            shift += BITS
+        return node.find(key, key_hash, shift)
+    def assoc(self, entry, shift):
+        # returns the new node, and whether it has one more entry than this one
+        bit = 1 << ((entry[2] >> shift) & MASK)
+        index = _index(self.bitmap, bit)
+        if not self.bitmap & bit:
+            return _BitmapNode(self.bitmap | bit, self.entries[:index] + (entry,) + self.entries[index:]), True
+        existing = self.entries[index]
+        if type(existing) is tuple:
+            if _same_key(existing[0], entry[0]):
+                if existing[1] is entry[1]:
+                    return self, False
+                return _BitmapNode(self.bitmap, _replaced(self.entries, index, entry)), False
+            child = _pair_node(existing, entry, shift + BITS)
+            return _BitmapNode(self.bitmap, _replaced(self.entries, index, child)), True
+        child, added = existing.assoc(entry, shift + BITS)
+        if child is existing:
+            return self, False
+        return _BitmapNode(self.bitmap, _replaced(self.entries, index, child)), added
+    def dissoc(self, key, key_hash, shift):
+        # returns the new node (None once it's empty), or this one if the key isn't here
+        bit = 1 << ((key_hash >> shift) & MASK)
+        if not self.bitmap & bit:
+            return self
+        index = _index(self.bitmap, bit)
+        existing = self.entries[index]
+        if type(existing) is tuple:
+            if not _same_key(existing[0], key):
+                return self
+            if self.bitmap == bit:
+                return None
+            return _BitmapNode(self.bitmap ^ bit, _removed(self.entries, index))
+        child = existing.dissoc(key, key_hash, shift + BITS)
+        if child is existing:
+            return self
+        if child is None:
+            if self.bitmap == bit:
+                return None
+            return _BitmapNode(self.bitmap ^ bit, _removed(self.entries, index))
+        if len(child.entries) == 1 and type(child.entries[0]) is tuple:
+            # a lone entry moves back up, so removing keys leaves the same shape adding them would
+            child = child.entries[0]
+        return _BitmapNode(self.bitmap, _replaced(self.entries, index, child))
+    def iterate(self):
+        for entry in self.entries:
+            if type(entry) is tuple:
+                yield entry
+            else:
+                yield from entry.iterate()
+
+class _CollisionNode:
+    __slots__ = ('entries',)
+    def __init__(self, entries):
+        self.entries = entries
+    def find(self, key, key_hash, shift):
+        for entry in self.entries:
+            if _same_key(entry[0], key):
+                return entry
+        return None
+    def assoc(self, entry, shift):
+        for index, existing in enumerate(self.entries):
+            if _same_key(existing[0], entry[0]):
+                if existing[1] is entry[1]:
+                    return self, False
+                return _CollisionNode(_replaced(self.entries, index, entry)), False
+        return _CollisionNode(self.entries + (entry,)), True
+    def dissoc(self, key, key_hash, shift):
+        for index, existing in enumerate(self.entries):
+            if _same_key(existing[0], key):
+                if len(self.entries) == 1:
+                    return None
+                return _CollisionNode(_removed(self.entries, index))
+        return self
+    def iterate(self):
+        return iter(self.entries)
+
+class PersistentMap:
+    """An immutable mapping. assoc and dissoc return new maps that share structure with this one.
+    Equality and hashing are structural, like Pair's, so maps can be keys of other maps."""
+    __slots__ = ('root', 'count', 'hash')
+    def __init__(self, root = None, count = 0):
+        self.root = root
+        self.count = count
+        # computed the first time someone asks. it's safe to keep, since the map never changes
+        self.hash = None
+    def get(self, key, default = None):
+        if self.root is None:
+            return default
+        entry = self.root.find(key, _hash(key), 0)
+        return default if entry is None else entry[1]
+    def __getitem__(self, key):
+        entry = None if self.root is None else self.root.find(key, _hash(key), 0)
+        if entry is None:
+            raise KeyError(key)
+        return entry[1]
+    def __contains__(self, key):
+        return self.root is not None and self.root.find(key, _hash(key), 0) is not None
+    def assoc(self, key, value):
+        entry = (key, value, _hash(key))
+        if self.root is None:
+            return PersistentMap(_BitmapNode(1 << (entry[2] & MASK), (entry,)), 1)
+        root, added = self.root.assoc(entry, 0)
+        if root is self.root:
+            return self
+        return PersistentMap(root, self.count + 1 if added else self.count)
+    def dissoc(self, key):
+        if self.root is None:
+            return self
+        root = self.root.dissoc(key, _hash(key), 0)
+        if root is self.root:
+            return self
+        return PersistentMap(root, self.count - 1)
+    def __len__(self):
+        return self.count
+    def items(self):
+        if self.root is None:
+            return iter(())
+        return ((entry[0], entry[1]) for entry in self.root.iterate())
+    def keys(self):
+        return (key for key, _ in self.items())
+    def __iter__(self):
+        return self.keys()
+    def __eq__(self, other):
+        if type(other) is not PersistentMap or self.count != other.count:
+            return False
+        if self.root is other.root:
+            return True
+        missing = object()
+        for key, value in self.items():
+            if not other.get(key, missing) == value:
+                return False
+        return True
+    def __hash__(self):
+        if self.hash is None:
+            # the order entries come out in depends on how the trie was built, so combine them
+            # in a way that doesn't care about order
+            result = 0
+            for entry in self.root.iterate() if self.root is not None else ():
+                result ^= hash((entry[2], entry[1]))
+            self.hash = hash((PersistentMap, self.count, result))
+        return self.hash
+    def __repr__(self):
+        return 'PersistentMap({%s})' % ', '.join('%r: %r' % item for item in self.items())
+
+EMPTY_MAP = PersistentMap()
+
+def from_items(items):
+    result = EMPTY_MAP
+    for key, value in items:
+        result = result.assoc(key, value)
+    return result
@@ -1,9 +1,30 @@
 from evaluator import Scope, eval_node
 from reader import Node, IdentifierNode, FormNode
-from core import nil, Pair, void
+from core import nil, Pair, Array, Vector, Symbol, void
 import specials
 
+# Matching never raises: match and compiled matchers return False. Whoever gives up on a failed
+# match raises one of these, which holds on to the pattern and the value and only formats them
+# (an O(size) repr of the value) if someone actually looks at the message.
+class PatternMatchError(Exception):
+    def __init__(self, pattern, target):
+        super().__init__()
+        self.pattern = pattern
+        self.target = target
+    def __str__(self):
+        return "pattern did not match. pattern: '%s' actual: '%s'" % (self.pattern.nice_repr(), repr(self.target))
+
+class NoMatchingClauseError(Exception):
+    def __init__(self, multi_function, target):
+        super().__init__()
+        self.multi_function = multi_function
+        self.target = target
+    def __str__(self):
+        return "No pattern matched. patterns: %s actual: '%s'" % (
+            ', '.join(["'%s'" % func.pattern.nice_repr() for func in self.multi_function.functions]), repr(self.target))
+
 class Pattern:
+    __slots__ = ()
     def call(self, arg, scope):
         assert type(arg) is Pair or arg is nil
         if arg is nil:
@@ -12,11 +33,21 @@ class Pattern:
             assert eval_node(arg.cdr, scope) is nil
             target = eval_node(arg.car, scope)
         if not self.match(target, scope, True):
-            # return False
-            raise Exception("pattern failed to match")
+            raise PatternMatchError(self, target)
         return True
+    # Returns a matcher(target, scope) function that does what match(target, scope) would,
+    # without walking the pattern tree. Given the layout of the frames it'll be matching into,
+    # identifiers get written straight into their slots.
+    def compile(self, layout = None):
+        return self.match
+    # Returns an items_matcher(items, scope) that matches a python list of values the way the
+    # matcher would match a proper list of them, so callers don't have to cons up the argument
+    # list just for it to be taken apart again. None when the pattern needs the whole list.
+    def compile_items(self, layout = None):
+        return None
 
 class IdentifierPattern(Pattern):
+    __slots__ = ('identifier',)
     def __init__(self, identifier_node, scope):
         assert type(identifier_node) is IdentifierNode
         self.identifier = identifier_node.identifier
@@ -28,6 +59,24 @@ class IdentifierPattern(Pattern):
         else:
             scope.set(self.identifier, target)
         return True
+    def compile(self, layout = None):
+        identifier = self.identifier
+        if layout is not None and identifier in layout.slots:
+            slot = layout.slots[identifier]
+            def matcher(target, scope):
+                if target is void:
+                    return False
+                scope.slots[slot] = target
+                return True
+        else:
+            def matcher(target, scope):
+                if target is void:
+                    return False
+                scope.set(identifier, target)
+                return True
+        return matcher
+    def identifiers(self):
+        return [self.identifier]
     def __repr__(self):
         return "(IdentifierPattern %s)" % self.identifier
     def nice_repr(self):
@@ -36,10 +85,18 @@ class IdentifierPattern(Pattern):
         return type(other) is IdentifierPattern and self.identifier == other.identifier
 
 class ValuePattern(Pattern):
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value
     def match(self, target, scope, recursive = False):
         return self.value == target
+    def compile(self, layout = None):
+        value = self.value
+        if value is nil:
+            return lambda target, scope: target is nil
+        return lambda target, scope: value == target
+    def identifiers(self):
+        return []
     def __repr__(self):
         return "(ValuePattern %s)" % repr(self.value)
     def nice_repr(self):
@@ -59,6 +116,7 @@ def rec_pattern(arg, scope):
 
 # The recursive thing is just a convenience so that (list 1 2) will expand to multiple ConsPatterns.
 class ConsPattern(Pattern):
+    __slots__ = ('car_pattern', 'cdr_pattern')
     def __init__(self, pair, scope, recursive = False):
         assert type(pair) is Pair
         self.car_pattern = specials.pattern(pair.car, scope)
@@ -69,9 +127,80 @@ class ConsPattern(Pattern):
     def match(self, target, scope, recursive = False):
         if target is nil or target is void:
             return self.car_pattern.match(void, scope, recursive) and self.cdr_pattern.match(target, scope, recursive)
+        if type(target) is Array or type(target) is Vector:
+            return self.match_items(target, scope, recursive)
         if type(target) is not Pair:
             return False
         return self.car_pattern.match(target.car, scope, recursive) and self.cdr_pattern.match(target.cdr, scope, recursive)
+    # Arrays and Vectors destructure like lists, except that whatever's left over for a rest
+    # pattern is the same kind of sequence (or nil, once they run out), and we index instead of
+    # slicing at every step. The rest shares the sequence's items rather than copying them.
+    def match_items(self, items, scope, recursive):
+        pattern = self
+        i = 0
+        while type(pattern) is ConsPattern:
+            if i == len(items):
+                return pattern.match(nil, scope, recursive)
+            if not pattern.car_pattern.match(items[i], scope, recursive):
+                return False
+            pattern = pattern.cdr_pattern
+            i += 1
+        if i == len(items):
+            return pattern.match(nil, scope, recursive)
+        return pattern.match(items.drop(i), scope, recursive)
+    def compile(self, layout = None):
+        # flatten the spine of a list pattern, so [a b c] is one loop rather than three
+        # nested ConsPattern matches
+        spine = []
+        pattern = self
+        while type(pattern) is ConsPattern:
+            spine.append(pattern)
+            pattern = pattern.cdr_pattern
+        steps = [(cons_pattern, cons_pattern.car_pattern.compile(layout)) for cons_pattern in spine]
+        rest = pattern.compile(layout)
+        def matcher(target, scope):
+            for cons_pattern, car in steps:
+                if type(target) is Pair:
+                    if not car(target.car, scope):
+                        return False
+                    target = target.cdr
+                elif target is nil or target is void:
+                    if not car(void, scope):
+                        return False
+                elif type(target) is Array or type(target) is Vector:
+                    return cons_pattern.match(target, scope)
+                else:
+                    return False
+            return rest(target, scope)
+        return matcher
+    def compile_items(self, layout = None):
+        cars = []
+        pattern = self
+        while type(pattern) is ConsPattern:
+            cars.append(pattern.car_pattern.compile(layout))
+            pattern = pattern.cdr_pattern
+        rest = pattern.compile(layout)
+        proper = type(pattern) is ValuePattern and pattern.value is nil
+        width = len(cars)
+        def items_matcher(items, scope):
+            for car, item in zip(cars, items):
+                if not car(item, scope):
+                    return False
+            # missing arguments are void, as they'd be past the end of a list
+            count = len(items)
+            for i in range(count, width):
+                if not cars[i](void, scope):
+                    return False
+            if proper:
+                return count <= width
+            # only a rest pattern sees a list, of whatever's left over
+            target = nil
+            for i in range(count - 1, width - 1, -1):
+                target = Pair(items[i], target)
+            return rest(target, scope)
+        return items_matcher
+    def identifiers(self):
+        return self.car_pattern.identifiers() + self.cdr_pattern.identifiers()
     def __repr__(self):
         return "(ConsPattern %s %s)" % (repr(self.car_pattern), repr(self.cdr_pattern))
     def nice_repr(self):
@@ -80,6 +209,7 @@ class ConsPattern(Pattern):
         return type(other) is ConsPattern and self.car_pattern == other.car_pattern and self.cdr_pattern == other.cdr_pattern
 
 class PredicatedPattern(Pattern):
+    __slots__ = ('pattern', 'predicate')
     def __init__(self, pattern, predicate):
         self.pattern = pattern
         assert type(self.pattern) is not DefaultedPattern, "you can't apply a predicate to a defaulted pattern. it just doesn't make sense."
@@ -87,6 +217,12 @@ class PredicatedPattern(Pattern):
     def match(self, target, scope, recursive = False):
         # TODO: allow non-builtin functions here
         return self.pattern.match(target, scope, recursive) and self.predicate(Pair(target, nil), None) is True
+    def compile(self, layout = None):
+        inner = self.pattern.compile(layout)
+        predicate = self.predicate
+        return lambda target, scope: inner(target, scope) and predicate(Pair(target, nil), None) is True
+    def identifiers(self):
+        return self.pattern.identifiers()
     def __repr__(self):
         return "(PredicatedPattern %s %s)" % (repr(self.pattern), repr(self.predicate))
     def nice_repr(self):
@@ -95,6 +231,7 @@ class PredicatedPattern(Pattern):
         return type(other) is PredicatedPattern and self.pattern == other.pattern and self.predicate == other.predicate
 
 class DefaultedPattern(Pattern):
+    __slots__ = ('pattern', 'default_value')
     def __init__(self, pattern, default_value):
         assert isinstance(pattern, Pattern)
         self.pattern = pattern
@@ -104,6 +241,16 @@ class DefaultedPattern(Pattern):
             return self.pattern.match(self.default_value, scope, recursive)
         else:
             return self.pattern.match(target, scope) or self.pattern.match(self.default_value, scope)
+    def compile(self, layout = None):
+        inner = self.pattern.compile(layout)
+        default_value = self.default_value
+        def matcher(target, scope):
+            if target is void:
+                return inner(default_value, scope)
+            return inner(target, scope) or inner(default_value, scope)
+        return matcher
+    def identifiers(self):
+        return self.pattern.identifiers()
     def __repr__(self):
         return "(DefaultedPattern %s %s)" % (repr(self.pattern), repr(self.default_value))
     def nice_repr(self):
@@ -112,6 +259,7 @@ class DefaultedPattern(Pattern):
         return type(other) is DefaultedPattern and self.pattern == other.pattern and self.default_value == other.default_value
 
 class AliasedPattern(Pattern):
+    __slots__ = ('left_pattern', 'right_pattern')
     def __init__(self, left_pattern, right_pattern):
         assert isinstance(left_pattern, Pattern)
         assert isinstance(right_pattern, Pattern)
@@ -119,6 +267,12 @@ class AliasedPattern(Pattern):
         self.right_pattern = right_pattern
     def match(self, target, scope, recursive = False):
         return self.left_pattern.match(target, scope, recursive) and self.right_pattern.match(target, scope, recursive)
+    def compile(self, layout = None):
+        left = self.left_pattern.compile(layout)
+        right = self.right_pattern.compile(layout)
+        return lambda target, scope: left(target, scope) and right(target, scope)
+    def identifiers(self):
+        return self.left_pattern.identifiers() + self.right_pattern.identifiers()
     def __repr__(self):
         return "(AliasedPattern %s %s)" % (repr(self.left_pattern), repr(self.right_pattern))
     def nice_repr(self):
@@ -127,6 +281,7 @@ class AliasedPattern(Pattern):
         return type(other) is AliasedPattern and self.left_pattern == other.left_pattern and self.right_pattern == other.right_pattern
 
 class DefaultArgumentsPattern(Pattern):
+    __slots__ = ()
     def __init__(self):
         pass
     def match(self, target, scope, recursive = False):
@@ -136,6 +291,13 @@ class DefaultArgumentsPattern(Pattern):
         if target is nil:
             return True
 
+        if type(target) is Array or type(target) is Vector:
+            for index, item in enumerate(target):
+                scope.set('-%d' % (index + 1), item)
+            if len(target) > 0:
+                scope.set('-', target[0])
+            return True
+
         index = 1
         arg = target
         while arg != nil:
@@ -147,9 +309,112 @@ class DefaultArgumentsPattern(Pattern):
         scope.set('-', target.car)
 
         return True
+    def identifiers(self):
+        # the numbered -1, -2, ... identifiers depend on the target, so the evaluator
+        # finds the ones a function actually uses by looking at its body
+        return ['--', '-']
     def __repr__(self):
         return "(DefaultArgumentsPattern)"
     def nice_repr(self):
         return repr(self)
     def __eq__(self, other):
         return type(other) is DefaultArgumentsPattern
+
+# Helpers for DispatchIndex. They only ever need to be conservative: answering True when a
+# pattern can't actually match just means MultiFunction tries a clause it didn't need to.
+
+LITERAL_TYPES = set([int, bool, str, Symbol, type(None)])
+
+def _accepts_void(pattern):
+    if type(pattern) is IdentifierPattern:
+        return False
+    if type(pattern) is ValuePattern:
+        return pattern.value is void
+    if type(pattern) is PredicatedPattern:
+        return _accepts_void(pattern.pattern)
+    if type(pattern) is AliasedPattern:
+        return _accepts_void(pattern.left_pattern) and _accepts_void(pattern.right_pattern)
+    return True
+
+def _accepts_element(pattern, key):
+    # key is what DispatchIndex knows about the element; see DispatchIndex.element_key
+    if type(pattern) is ValuePattern:
+        if pattern.value is nil:
+            return key == 'nil'
+        if type(pattern.value) in LITERAL_TYPES:
+            return type(key) is tuple and key[1] == pattern.value
+        return True
+    if type(pattern) is ConsPattern:
+        return key == 'cons' or key == 'nil'
+    if type(pattern) is PredicatedPattern:
+        return _accepts_element(pattern.pattern, key)
+    if type(pattern) is AliasedPattern:
+        return _accepts_element(pattern.left_pattern, key) and _accepts_element(pattern.right_pattern, key)
+    return True
+
+class DispatchIndex:
+    """Narrows down which of a multi-function's clauses could match an argument, based on the
+    argument's length and what's in each position: a cons, nil, one of the literals some clause
+    matches on, or anything else. Argument keys are bounded by the longest clause pattern and
+    the literals that appear in the patterns, so the cache of candidates stays small."""
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.spines = []
+        for pattern in patterns:
+            spine = []
+            while type(pattern) is ConsPattern:
+                spine.append(pattern.car_pattern)
+                pattern = pattern.cdr_pattern
+            self.spines.append((spine, pattern))
+        self.width = max([len(spine) for spine, _ in self.spines] + [0])
+        self.literals = [set() for _ in range(self.width)]
+        for spine, _ in self.spines:
+            for i, car_pattern in enumerate(spine):
+                if type(car_pattern) is ValuePattern and type(car_pattern.value) in LITERAL_TYPES:
+                    self.literals[i].add(car_pattern.value)
+        self.all = tuple(range(len(patterns)))
+        self.cache = {}
+    def element_key(self, i, element):
+        if type(element) is Pair or type(element) is Array or type(element) is Vector:
+            return 'cons'
+        if element is nil:
+            return 'nil'
+        if type(element) in LITERAL_TYPES and element in self.literals[i]:
+            return ('value', element)
+        return 'other'
+    def key(self, target):
+        # None means we don't know anything useful (an improper list, say)
+        keys = []
+        while type(target) is Pair:
+            if len(keys) == self.width:
+                return (self.width + 1, tuple(keys))
+            keys.append(self.element_key(len(keys), target.car))
+            target = target.cdr
+        if target is not nil:
+            return None
+        return (len(keys), tuple(keys))
+    def candidates(self, target):
+        key = self.key(target)
+        if key is None:
+            return self.all
+        if key not in self.cache:
+            self.cache[key] = tuple(i for i, spine in enumerate(self.spines) if self.may_match(spine, *key))
+        return self.cache[key]
+    def may_match(self, spine, length, keys):
+        cars, rest = spine
+        if len(cars) == 0:
+            return True
+        for car_pattern, key in zip(cars, keys):
+            if not _accepts_element(car_pattern, key):
+                return False
+        if length < len(cars):
+            # the rest of the cars see void, and the rest pattern sees nil
+            return all(_accepts_void(car_pattern) for car_pattern in cars[length:]) and \
+                not (type(rest) is ValuePattern and rest.value is not nil)
+        if type(rest) is ValuePattern:
+            # the argument's a proper list, so the rest is nil or a list, which a literal rest
+            # is compared with as a whole
+            if rest.value is nil:
+                return length == len(cars)
+            return type(rest.value) is Pair and length > len(cars)
+        return True
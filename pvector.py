@@ -0,0 +1,202 @@
+# A persistent (immutable) vector: a trie of 32-way nodes holding the elements in order, plus a
+# tail of up to 32 elements that haven't been pushed into the trie yet. Reads walk log32(n)
+# levels, appends usually only copy the tail, and assoc copies the nodes on the path to one
+# element and shares the rest with the vector it started from.
+#
+# A TransientVector builds one up in place: the nodes it makes are tagged with its edit token
+# and mutated directly, anything else is copied the first time it's touched. persistent() hands
+# the result over as a PersistentVector, after which the transient can't be used.
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+class _Node:
+    __slots__ = ('edit', 'array')
+    def __init__(self, edit, array):
+        self.edit = edit
+        self.array = array
+
+EMPTY_NODE = _Node(None, [None] * WIDTH)
+
+def _tail_offset(count):
+    return 0 if count < WIDTH else ((count - 1) >> BITS) << BITS
+
+def _new_path(edit, level, node):
+    while level > 0:
+        node = _Node(edit, [node] + [None] * (WIDTH - 1))
+        level -= BITS
+    return node
+
+def _leaf(count, shift, root, tail, index):
+    # the array holding element index
+    if index >= _tail_offset(count):
+        return tail
+    node = root
+    level = shift
+    while level > 0:
+        node = node.array[(index >> level) & MASK]
+        level -= BITS
+    return node.array
+
+class PersistentVector:
+    __slots__ = ('count', 'shift', 'root', 'tail')
+    def __init__(self, count, shift, root, tail):
+        self.count = count
+        self.shift = shift
+        self.root = root
+        self.tail = tail
+    def __len__(self):
+        return self.count
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('vector index out of range')
+        return _leaf(self.count, self.shift, self.root, self.tail, index)[index & MASK]
+    def __iter__(self):
+        tail_offset = _tail_offset(self.count)
+        for start in range(0, tail_offset, WIDTH):
+            yield from _leaf(self.count, self.shift, self.root, self.tail, start)
+        yield from self.tail
+    def append(self, value):
+        count = self.count
+        if count - _tail_offset(count) < WIDTH:
+            return PersistentVector(count + 1, self.shift, self.root, self.tail + [value])
+        # the tail's full, so it goes into the trie, which grows a level if that's full too
+        tail_node = _Node(None, self.tail)
+        shift = self.shift
+        if (count >> BITS) > (1 << shift):
+            root = _Node(None, [self.root, _new_path(None, shift, tail_node)] + [None] * (WIDTH - 2))
+            shift += BITS
+        else:
+            root = _push_tail(None, count, shift, self.root, tail_node)
+        return PersistentVector(count + 1, shift, root, [value])
+    def assoc(self, index, value):
+        if index < 0:
+            index += self.count
+        if index == self.count:
+            return self.append(value)
+        if not 0 <= index < self.count:
+            raise IndexError('vector index out of range')
+        if index >= _tail_offset(self.count):
+            tail = list(self.tail)
+            tail[index & MASK] = value
+            return PersistentVector(self.count, self.shift, self.root, tail)
+        return PersistentVector(self.count, self.shift, _assoc(self.shift, self.root, index, value), self.tail)
+    def transient(self):
+        return TransientVector(self)
+    def __eq__(self, other):
+        if type(other) is not PersistentVector or self.count != other.count:
+            return False
+        return all(a is b or a == b for a, b in zip(self, other))
+    def __hash__(self):
+        return hash(tuple(self))
+    def __repr__(self):
+        return 'PersistentVector(%r)' % list(self)
+
+def _push_tail(edit, count, level, parent, tail_node):
+    array = list(parent.array)
+    index = ((count - 1) >> level) & MASK
+    if level == BITS:
+        array[index] = tail_node
+    elif array[index] is None:
+        array[index] = _new_path(edit, level - BITS, tail_node)
+    else:
+        array[index] = _push_tail(edit, count, level - BITS, array[index], tail_node)
+    return _Node(edit, array)
+
+def _assoc(level, node, index, value):
+    array = list(node.array)
+    if level == 0:
+        array[index & MASK] = value
+    else:
+        child = (index >> level) & MASK
+        array[child] = _assoc(level - BITS, array[child], index, value)
+    return _Node(None, array)
+
+EMPTY_VECTOR = PersistentVector(0, BITS, EMPTY_NODE, [])
+
+class TransientVector:
+    __slots__ = ('edit', 'count', 'shift', 'root', 'tail')
+    def __init__(self, vector):
+        self.edit = object()
+        self.count = vector.count
+        self.shift = vector.shift
+        self.root = vector.root
+        self.tail = list(vector.tail)
+    def _editable(self, node):
+        if self.edit is None:
+            raise Exception('a transient vector cannot be changed after persistent()')
+        if node.edit is self.edit:
+            return node
+        return _Node(self.edit, list(node.array))
+    def __len__(self):
+        return self.count
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('vector index out of range')
+        return _leaf(self.count, self.shift, self.root, self.tail, index)[index & MASK]
+    def append(self, value):
+        if self.edit is None:
+            raise Exception('a transient vector cannot be changed after persistent()')
+        count = self.count
+        if count - _tail_offset(count) < WIDTH:
+            self.tail.append(value)
+            self.count += 1
+            return self
+        tail_node = _Node(self.edit, self.tail)
+        self.tail = [value]
+        if (count >> BITS) > (1 << self.shift):
+            self.root = _Node(self.edit, [self.root, _new_path(self.edit, self.shift, tail_node)] + [None] * (WIDTH - 2))
+            self.shift += BITS
+        else:
+            self.root = self._push_tail(self.shift, self.root, tail_node)
+        self.count += 1
+        return self
+    def _push_tail(self, level, parent, tail_node):
+        parent = self._editable(parent)
+        index = ((self.count - 1) >> level) & MASK
+        if level == BITS:
+            parent.array[index] = tail_node
+        elif parent.array[index] is None:
+            parent.array[index] = _new_path(self.edit, level - BITS, tail_node)
+        else:
+            parent.array[index] = self._push_tail(level - BITS, parent.array[index], tail_node)
+        return parent
+    def assoc(self, index, value):
+        if index < 0:
+            index += self.count
+        if index == self.count:
+            return self.append(value)
+        if not 0 <= index < self.count:
+            raise IndexError('vector index out of range')
+        if index >= _tail_offset(self.count):
+            self.tail[index & MASK] = value
+            return self
+        self.root = self._editable(self.root)
+        node = self.root
+        level = self.shift
+        while level > 0:
+            child = (index >> level) & MASK
+            editable = self._editable(node.array[child])
+            node.array[child] = editable
+            node = editable
+            level -= BITS
+        node.array[index & MASK] = value
+        return self
+    def persistent(self):
+        if self.edit is None:
+            raise Exception('persistent() can only be called once on a transient vector')
+        self.edit = None
+        vector = PersistentVector(self.count, self.shift, self.root, self.tail)
+        self.tail = None
+        return vector
+
+def from_iterable(iterable):
+    transient = EMPTY_VECTOR.transient()
+    for item in iterable:
+        transient.append(item)
+    return transient.persistent()
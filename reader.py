@@ -3,10 +3,16 @@
 PAIR_CDR_TOKEN = '|'
 
 class Node:
-    pass
+    # the compiled closures, filled in by evaluator.compile_node and evaluator.compile_tail
+    __slots__ = ('code', 'tail_code')
+    def __init__(self):
+        self.code = None
+        self.tail_code = None
 
 class ValueNode(Node):
+    __slots__ = ('value', 'name')
     def __init__(self, name, value):
+        super().__init__()
         assert type(name) is str
         self.value = value
         self.name = name
@@ -17,8 +23,28 @@ class ValueNode(Node):
     def __eq__(self, other):
         return type(other) is ValueNode and self.value == other.value
 
+# What evaluator.fold_constants replaces a form with when it calls pure builtins on constants.
+# It evaluates to value, as long as each identifier in guards (the heads of the form and of any
+# forms folded into it) still refers to the builtin it did; otherwise the form is evaluated.
+class FoldedNode(Node):
+    __slots__ = ('form', 'value', 'guards')
+    def __init__(self, form, value, guards):
+        super().__init__()
+        assert type(form) is FormNode
+        self.form = form
+        self.value = value
+        self.guards = guards
+    def __repr__(self):
+        return repr(self.form)
+    def __str__(self):
+        return "(FoldedNode %s)" % str(self.form)
+    def __eq__(self, other):
+        return type(other) is FoldedNode and self.form == other.form
+
 class BinaryOperatorNode(Node):
+    __slots__ = ('token', 'special_form', 'precedence', 'associativity')
     def __init__(self, token, special_form, precedence, associativity):
+        super().__init__()
         self.token = token
         self.special_form = special_form
         self.precedence = precedence
@@ -29,7 +55,9 @@ class BinaryOperatorNode(Node):
         return "BinaryOperatorNode '%s'" % self.token
 
 class UnaryOperatorNode(Node):
+    __slots__ = ('token', 'special_forms')
     def __init__(self, token, special_forms):
+        super().__init__()
         self.token = token
         self.special_forms = special_forms
     def __repr__(self):
@@ -48,27 +76,47 @@ def parse_forms(lst, is_form_node = True):
 
     if lst[0] == PAIR_CDR_TOKEN: # [| b]
         raise Exception("cannot have a cdr without a car")
-    if len(lst) > 1 and lst[1] == PAIR_CDR_TOKEN:
-        if len(lst) == 2: # [a |]
-            raise Exception("no cdr specified after explicit cdr")
-        if len(lst) > 3: # [a | b c]
-            raise Exception("can only specify one cdr")
-        return constructor(lst[0], lst[2])
 
-    return constructor(parse_forms(lst[0]), parse_forms(lst[1:], False))
+    # everything before the explicit cdr (if there is one) gets consed onto it, back to front.
+    # the cdr token is the only string that makes it this far, and checking the type first
+    # avoids a Python-level __eq__ call on every node
+    end = len(lst)
+    last = nil
+    for i in range(1, len(lst)):
+        if type(lst[i]) is str and lst[i] == PAIR_CDR_TOKEN:
+            if len(lst) == i + 1: # [a |]
+                raise Exception("no cdr specified after explicit cdr")
+            if len(lst) > i + 2: # [a | b c]
+                raise Exception("can only specify one cdr")
+            end = i - 1
+            last = (constructor if end == 0 else Pair)(lst[end], lst[i + 1])
+            break
+
+    for i in range(end - 1, 0, -1):
+        last = Pair(parse_forms(lst[i]), last)
+    if end == 0:
+        return last
+    return constructor(parse_forms(lst[0]), last)
 
 def get_form_repr(form_or_pair):
-    prefix = '(' if type(form_or_pair) is FormNode else ''
-    if form_or_pair.cdr is nil:
-        return "%s%s)" % (prefix, repr(form_or_pair.car))
-    elif type(form_or_pair.cdr) is Pair:
-        return "%s%s %s" % (prefix, repr(form_or_pair.car), get_form_repr(form_or_pair.cdr))
-    else:
-        return "%s%s | %s)" % (prefix, repr(form_or_pair.car), repr(form_or_pair.cdr))
+    parts = ['(' if type(form_or_pair) is FormNode else '']
+    parts.append(repr(form_or_pair.car))
+    rest = form_or_pair.cdr
+    while type(rest) is Pair:
+        parts.append(' ')
+        parts.append(repr(rest.car))
+        rest = rest.cdr
+    if rest is not nil:
+        parts.append(' | ')
+        parts.append(repr(rest))
+    parts.append(')')
+    return ''.join(parts)
 
 # should this be a subclass of Pair?
 class FormNode(Node):
+    __slots__ = ('car', 'cdr')
     def __init__(self, car, cdr):
+        super().__init__()
         self.car = car
         self.cdr = cdr
     def __repr__(self):
@@ -81,7 +129,9 @@ class FormNode(Node):
         return type(other) is FormNode and self.car == other.car and self.cdr == other.cdr
 
 class IdentifierNode(Node):
+    __slots__ = ('identifier',)
     def __init__(self, token):
+        super().__init__()
         assert type(token) is str
         self.identifier = token
     def __repr__(self):
@@ -92,7 +142,9 @@ class IdentifierNode(Node):
         return type(other) is IdentifierNode and self.identifier == other.identifier
 
 class SymbolLiteralNode(Node):
+    __slots__ = ('value',)
     def __init__(self, token):
+        super().__init__()
         assert type(token) is str
         self.value = token[1:]
     def __repr__(self):
@@ -103,7 +155,9 @@ class SymbolLiteralNode(Node):
         return type(other) is SymbolLiteralNode and self.value == other.value
 
 class NumericLiteralNode(Node):
+    __slots__ = ('value',)
     def __init__(self, token):
+        super().__init__()
         assert type(token) is str
         self.value = token
     def __repr__(self):
@@ -113,66 +167,15 @@ class NumericLiteralNode(Node):
     def __eq__(self, other):
         return type(other) is NumericLiteralNode and self.value == other.value
 
-def lookahead(indexable):
-    i = 0
-    while i < len(indexable):
-        yield (indexable[i], indexable[i + 1] if i < len(indexable) - 1 else None)
-        i += 1
+def tokenize(code): # yields (token, offset) pairs in a single pass over the string
+    for match in TOKEN_REGEX.finditer(code):
+        yield (match.group(), match.start())
 
 def lex(code): # converts string to tokens, currently represented as simple strings
-    boundaries = set([' ', '\t', '\n', ',', PAIR_CDR_TOKEN]) | \
-        BINARY_OPERATORS.keys() | \
-        UNARY_OPERATORS.keys() | \
-        MATCHED_TOKENS.keys() | \
-        set([end for end, _ in MATCHED_TOKENS.values()])
-    tokens = []
-    def end_token(char_list):
-        token = ''.join(char_list)
-        if not re.match(r'^[ \t\n,]*$', token):
-            tokens.append(token)
-    current_token = []
-    skip_character = False
-    for current_char, next_char in lookahead(code):
-        if skip_character:
-            skip_character = False
-            continue
-        if next_char is not None and current_char + next_char in boundaries:
-            end_token(current_token)
-            end_token([current_char, next_char])
-            current_token = []
-            skip_character = True
-        elif current_char in boundaries:
-            end_token(current_token)
-            end_token([current_char])
-            current_token = []
-        else:
-            current_token += current_char
-    end_token(current_token)
-    return tokens
-
-def read_matched_code(tokens, end, constructor):
-    increasers = set([key for key in MATCHED_TOKENS if MATCHED_TOKENS[key][0] == end])
-    nesting_depth = 1
-    def pred(token):
-        nonlocal nesting_depth
-        if token in increasers:
-            nesting_depth += 1
-        elif token == end:
-            nesting_depth -= 1
-            return nesting_depth > 0
-        return True
-
-    form_tokens = list(takewhile(pred, tokens))
-    if nesting_depth != 0:
-        raise Exception("Unbalanced tokens")
-
-    if len(form_tokens) == 0:
-        return (constructor(), 1)
-
-    return (constructor(*parse_and_expand(form_tokens)), len(form_tokens) + 1) # +1 to account for the closing paren/bracket/whatever
+    return TOKEN_REGEX.findall(code)
 
 def parse_single_token(token):
-    if re.match(r'^\d+$', token):
+    if token.isdecimal(): # the same strings as r'^\d+$', without the regex
         return NumericLiteralNode(token)
     if token == PAIR_CDR_TOKEN:
         return PAIR_CDR_TOKEN
@@ -180,7 +183,7 @@ def parse_single_token(token):
         return BINARY_OPERATORS[token]
     if token in UNARY_OPERATORS:
         return UNARY_OPERATORS[token]
-    if re.match(r'^#[A-Za-z0-9-]+$', token):
+    if token[0] == '#' and SYMBOL_REGEX.match(token):
         return SymbolLiteralNode(token)
 
     return IdentifierNode(token)
@@ -195,6 +198,8 @@ MATCHED_TOKENS = {
     '#{': ('}', lambda *sexp: FormNode(ValueNode('_dictionary', specials.dictionary), parse_forms(sexp, False))),
 }
 
+CLOSING_TOKENS = set([end for end, _ in MATCHED_TOKENS.values()])
+
 def reverse_iterator(items):
     i = len(items) - 1
     while i >= 0:
@@ -205,19 +210,18 @@ def expand_unary_operators(nodes):
     output = []
     i = 0
 
-    def pop_node():
-        nonlocal i
+    while i < len(nodes):
+        operators = []
+        while i < len(nodes) and type(nodes[i]) is UnaryOperatorNode:
+            operators.append(nodes[i])
+            i += 1
         if i >= len(nodes):
             raise Exception("Unary operator must come before something")
         node = nodes[i]
         i += 1
-        if type(node) is UnaryOperatorNode:
-            return parse_forms(node.special_forms + (pop_node(),))
-        else:
-            return node
-
-    while i < len(nodes):
-        output.append(pop_node())
+        for operator in reversed(operators):
+            node = parse_forms(operator.special_forms + (node,))
+        output.append(node)
 
     return output
 
@@ -254,41 +258,120 @@ def expand_binary_operators(nodes):
 
     drain_operator_stack()
 
-    def pop_node():
-        node = output_queue.pop()
+    # read from the back, the output queue is in prefix order. so from the front, it's
+    # postfix with each operator's operands swapped
+    operands = []
+    for node in output_queue:
         if type(node) is BinaryOperatorNode:
-            return parse_forms((node.special_form, pop_node(), pop_node()))
+            left = operands.pop()
+            right = operands.pop()
+            operands.append(parse_forms((node.special_form, left, right)))
         else:
-            return node
+            operands.append(node)
 
-    result = []
-    while len(output_queue) > 0:
-        result.append(pop_node())
-
-    return result
+    operands.reverse()
+    return operands
 
 def parse(tokens): # converts token stream to s-expressions, parses numeric literals, etc
-    if len(tokens) == 0:
-        return []
-
-    first = tokens[0]
-
-    if first in MATCHED_TOKENS:
-        matched_token, tokens_consumed = read_matched_code(tokens[1:], *MATCHED_TOKENS[first])
-        return [matched_token] + parse(tokens[1 + tokens_consumed:])
+    return list(parse_iter(tokens))
+
+def parse_iter(tokens): # like parse, but yields each top-level node as soon as it's complete
+    # the nodes of every group we're inside of, with the token that closes it and its constructor
+    stack = []
+    open_counts = dict((end, 0) for end in CLOSING_TOKENS)
+    nodes = []
+    for token in tokens:
+        if token in MATCHED_TOKENS:
+            end, constructor = MATCHED_TOKENS[token]
+            stack.append((end, constructor, nodes))
+            open_counts[end] += 1
+            nodes = []
+        elif len(stack) > 0 and token == stack[-1][0]:
+            end, constructor, outer_nodes = stack.pop()
+            open_counts[end] -= 1
+            outer_nodes.append(constructor(*expand_operators(nodes)))
+            nodes = outer_nodes
+        elif token in CLOSING_TOKENS and open_counts[token] > 0:
+            # this closes a group further out, while the innermost one is still open
+            raise Exception("Unbalanced tokens")
+        else:
+            nodes.append(parse_single_token(token))
+        if len(stack) == 0 and len(nodes) > 0:
+            yield nodes.pop()
+    if len(stack) > 0:
+        raise Exception("Unbalanced tokens")
 
-    return [parse_single_token(first)] + parse(tokens[1:])
+def expand_operators(nodes):
+    for node in nodes:
+        if type(node) is UnaryOperatorNode or type(node) is BinaryOperatorNode:
+            return expand_binary_operators(expand_unary_operators(nodes))
+    return nodes
 
 def parse_and_expand(tokens):
-    return expand_binary_operators(expand_unary_operators(parse(tokens)))
+    return expand_operators(parse(tokens))
 
 def read(code):
     return parse_and_expand(lex(code))
 
+CHUNK_SIZE = 64 * 1024
+
+def _chunks(file_like, chunk_size):
+    if type(file_like) is str:
+        yield file_like
+        return
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = file_like.read(chunk_size)
+        if len(chunk) == 0:
+            break
+        # binary files and mmaps hand us bytes, which might end halfway through a character
+        yield decoder.decode(chunk) if type(chunk) is not str else chunk
+    yield decoder.decode(b'', True)
+
+def tokenize_chunks(chunks): # lexes a stream of strings, as if they were concatenated
+    rest = ''
+    for chunk in chunks:
+        text = rest + chunk
+        rest = ''
+        for match in TOKEN_REGEX.finditer(text):
+            # a token that runs to the end of the chunk might continue into the next one
+            if match.end() == len(text):
+                rest = text[match.start():]
+            else:
+                yield match.group()
+    if len(rest) > 0:
+        yield from lex(rest)
+
+def _is_operator(node):
+    return type(node) is UnaryOperatorNode or type(node) is BinaryOperatorNode
+
+def read_iter(file_like, chunk_size = CHUNK_SIZE):
+    """Like read, but takes a string or anything with a read method (a file, binary or text, or
+    an mmap) and yields top-level forms one at a time, reading only as far as it has to."""
+    # operators join top-level nodes together, so we can only expand a run of nodes once
+    # we see two of them next to each other with no operator in between
+    run = []
+    for node in parse_iter(tokenize_chunks(_chunks(file_like, chunk_size))):
+        if len(run) > 0 and type(node) is not BinaryOperatorNode and not _is_operator(run[-1]):
+            yield from expand_operators(run)
+            run = []
+        run.append(node)
+    yield from expand_operators(run)
+
+def read_file(path):
+    """read_iter over a memory-mapped file."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0: # you can't mmap an empty file
+            return
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+            yield from read_iter(buffer)
+
 import specials
 import re
+import os
+import mmap
+import codecs
 from core import Pair, nil, void
-from itertools import takewhile
 
 BINARY_OPERATORS = {
     ':': BinaryOperatorNode(':', ValueNode('_cons', specials.cons), 2, 'right'),
@@ -302,3 +385,26 @@ UNARY_OPERATORS = {
     '~': UnaryOperatorNode('~', (ValueNode('_id', specials.id),)),
     '@': UnaryOperatorNode('@', (ValueNode('_get', specials.get), IdentifierNode('this'))),
 }
+
+SYMBOL_REGEX = re.compile(r'^#[A-Za-z0-9-]+$')
+
+WHITESPACE = ' \t\n,'
+
+def _build_token_regex():
+    boundaries = set([PAIR_CDR_TOKEN]) | \
+        BINARY_OPERATORS.keys() | \
+        UNARY_OPERATORS.keys() | \
+        MATCHED_TOKENS.keys() | \
+        set([end for end, _ in MATCHED_TOKENS.values()])
+    # longest first, so '::' wins over ':' and '#[' over an identifier starting with '#'
+    punctuation = '|'.join(re.escape(token) for token in sorted(boundaries, key=len, reverse=True))
+    long_punctuation = '|'.join(re.escape(token) for token in boundaries if len(token) > 1)
+    separators = WHITESPACE + ''.join(token for token in boundaries if len(token) == 1)
+    # characters like '#' only end a token when they start a longer bit of punctuation
+    leaders = ''.join(set(token[0] for token in boundaries if len(token) > 1) - set(separators))
+    # anything that isn't whitespace is either punctuation or part of an identifier-ish token,
+    # so finditer skips exactly the whitespace
+    return re.compile('%s|(?:[^%s]+|(?!%s)[%s])+' % (
+        punctuation, re.escape(separators + leaders), long_punctuation, re.escape(leaders)))
+
+TOKEN_REGEX = _build_token_regex()
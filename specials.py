@@ -1,7 +1,55 @@
 # imports at bottom of file
 
 def print_(arg, scope):
-    print(eval_node(arg.car, scope))
+    value = eval_node(arg.car, scope)
+    if type(value) is Pair:
+        # lists are written out as they're formatted
+        value.write(sys.stdout)
+        sys.stdout.write('\n')
+    else:
+        print(value)
+    return nil
+
+# files are named by python strings (handed in from outside) or symbols
+def _path(value):
+    if type(value) is Symbol:
+        return value.value
+    assert type(value) is str
+    return value
+
+# output to files goes through a buffer this big, rather than a write per line
+FILE_BUFFER_SIZE = 1 << 16
+
+def read_file(arg, scope):
+    assert type(arg) is Pair
+    assert eval_node(arg.cdr, scope) is nil
+    with open(_path(eval_node(arg.car, scope)), encoding = 'utf-8') as f:
+        return f.read()
+
+def read_lines(arg, scope):
+    assert type(arg) is Pair
+    assert eval_node(arg.cdr, scope) is nil
+    return streams.file_lines(_path(eval_node(arg.car, scope)))
+
+def write_file(arg, scope):
+    assert type(arg) is Pair
+    assert type(arg.cdr) is Pair
+    assert eval_node(arg.cdr.cdr, scope) is nil
+    path = _path(eval_node(arg.car, scope))
+    text = eval_node(arg.cdr.car, scope)
+    assert type(text) is str
+    with open(path, 'w', encoding = 'utf-8') as f:
+        f.write(text)
+    return nil
+
+def write_lines(arg, scope):
+    assert type(arg) is Pair
+    assert type(arg.cdr) is Pair
+    assert eval_node(arg.cdr.cdr, scope) is nil
+    path = _path(eval_node(arg.car, scope))
+    with open(path, 'w', encoding = 'utf-8', buffering = FILE_BUFFER_SIZE) as f:
+        # not kept in a variable, so that the lines that have been written can be freed
+        streams.write_lines(f, eval_node(arg.cdr.car, scope))
     return nil
 
 def add(arg, scope):
@@ -63,7 +111,9 @@ def redef(arg, scope):
     scope.set_recursive(arg.car.identifier, value)
     return value
 
-def if_(arg, scope):
+# evaluates the predicate and returns the node of the branch to take. the evaluator uses this
+# directly when an if is in tail position, so the branch can be a tail call too
+def if_branch(arg, scope):
     assert type(arg) is Pair
     assert type(arg.cdr) is Pair
     assert type(arg.cdr.cdr) is Pair
@@ -75,12 +125,15 @@ def if_(arg, scope):
 
     # TODO: should perform boolean coercion here
     if predicate_value is True:
-        return eval_node(then_node, scope)
+        return then_node
     elif predicate_value is False:
-        return eval_node(else_node, scope)
+        return else_node
     else:
         raise Exception("I can't perform boolean coercion yet")
 
+def if_(arg, scope):
+    return eval_node(if_branch(arg, scope), scope)
+
 def id(arg, scope):
     assert type(arg) is Pair
     assert eval_node(arg.cdr, scope) is nil
@@ -101,7 +154,9 @@ def call(arg, scope):
     assert type(arg) is Pair
     function = eval_node(arg.car, scope)
     assert type(arg.cdr) is Pair
-    return function(arg.cdr, scope)
+    if type(function) is FunctionType:
+        return function(arg.cdr, scope)
+    return function.call(arg.cdr, scope)
 
 def apply(arg, scope):
     assert type(arg) is Pair
@@ -110,31 +165,35 @@ def apply(arg, scope):
     argument = eval_node(arg.cdr.car, scope)
     assert type(argument) is Pair
     assert eval_node(arg.cdr.cdr, scope) is nil
-    return function(argument, scope)
+    return apply_evaluated(function, argument, scope)
 
 def curry(arg, scope):
     assert type(arg) is Pair
     function = eval_node(arg.car, scope)
     assert type(arg.cdr) is Pair
-    arguments = eval_node(arg.cdr, scope)
-    last = arguments
-    while last.cdr is not nil:
-        assert type(last) is Pair
-        last = last.cdr
-
-    def curried(more_args, scope):
-        assert type(more_args) is Pair
-        last.cdr = more_args
-        return function(arguments, scope)
-
-    return curried
+    evaled = eval_node(arg.cdr, scope)
+    arguments = []
+    while evaled is not nil:
+        assert type(evaled) is Pair
+        arguments.append(evaled.car)
+        evaled = evaled.cdr
+    return Partial(function, tuple(arguments))
+
+def memo(arg, scope):
+    assert type(arg) is Pair
+    function = eval_node(arg.car, scope)
+    if arg.cdr is nil:
+        return Memo(function)
+    assert type(arg.cdr) is Pair
+    assert eval_node(arg.cdr.cdr, scope) is nil
+    return Memo(function, eval_node(arg.cdr.car, scope))
 
 def list_(arg, scope):
     if arg is nil:
         return nil
     if type(arg) is not Pair:
         raise Exception('cannot have a cdr without a car')
-    return Pair(eval_node(arg.car, scope), eval_node(arg.cdr, scope))
+    return eval_node(arg, scope)
 
 def get(arg, scope):
     assert type(arg) is Pair
@@ -207,6 +266,9 @@ def pattern(arg, scope):
         return ValuePattern(nil, scope)
     if type(arg) is Pair:
         arg = arg.car
+    # patterns are made from the forms as they were written: [0] matches #[0], say, as well as 0:nil
+    if type(arg) is FoldedNode:
+        arg = arg.form
 
     if type(arg) is IdentifierNode:
         return IdentifierPattern(arg, scope)
@@ -235,7 +297,71 @@ def pattern(arg, scope):
     return ValuePattern(eval_node(arg, scope))
 
 def array(arg, scope):
-    raise Exception("not yet implemented")
+    items = []
+    while arg is not nil:
+        if type(arg) is not Pair:
+            raise Exception('arrays cannot have an explicit cdr')
+        items.append(eval_node(arg.car, scope))
+        arg = arg.cdr
+    return Array(items)
+
+def vector(arg, scope):
+    # built in place, then frozen
+    transient = EMPTY_VECTOR.transient()
+    while arg is not nil:
+        if type(arg) is not Pair:
+            raise Exception('vectors cannot have an explicit cdr')
+        transient.append(eval_node(arg.car, scope))
+        arg = arg.cdr
+    return Vector(transient.persistent())
+
+def length(arg, scope):
+    assert type(arg) is Pair
+    assert eval_node(arg.cdr, scope) is nil
+    sequence = eval_node(arg.car, scope)
+    if type(sequence) is Array or type(sequence) is Vector:
+        return len(sequence)
+    count = 0
+    while sequence is not nil:
+        assert type(sequence) is Pair
+        count += 1
+        sequence = sequence.cdr
+    return count
+
+def slice(arg, scope):
+    assert type(arg) is Pair
+    assert type(arg.cdr) is Pair
+    sequence = eval_node(arg.car, scope)
+    assert type(sequence) is Array or type(sequence) is Vector
+    length = len(sequence)
+    start = eval_node(arg.cdr.car, scope)
+    if arg.cdr.cdr is nil:
+        end = length
+    else:
+        assert type(arg.cdr.cdr) is Pair
+        assert eval_node(arg.cdr.cdr.cdr, scope) is nil
+        end = eval_node(arg.cdr.cdr.car, scope)
+    assert type(start) is int and type(end) is int
+    indexes = range(length)[start:end]
+    if type(sequence) is Vector:
+        if len(indexes) > 0 and indexes.stop == length:
+            # runs to the end, so it can share the vector's data
+            return sequence.drop(indexes.start)
+        return Vector(pvector.from_iterable(sequence[index] for index in indexes))
+    # arrays are mutable, so a slice is a copy
+    return Array(sequence.items[sequence.start + indexes.start:sequence.start + indexes.stop])
+
+def append(arg, scope):
+    assert type(arg) is Pair
+    assert type(arg.cdr) is Pair
+    assert eval_node(arg.cdr.cdr, scope) is nil
+    sequence = eval_node(arg.car, scope)
+    if type(sequence) is Vector:
+        # a new vector. the old one doesn't change
+        return sequence.append(eval_node(arg.cdr.car, scope))
+    assert type(sequence) is Array
+    sequence.append(eval_node(arg.cdr.car, scope))
+    return sequence
 
 def slash(arg, scope):
     raise Exception("not yet implemented")
@@ -261,6 +387,8 @@ def object(arg, scope):
     while arg is not nil:
         assert type(arg) is Pair
         slot = arg.car
+        if type(slot) is FoldedNode:
+            slot = slot.form
 
         if type(slot) is FormNode:
             func = eval_node(slot.car, scope)
@@ -298,17 +426,43 @@ def bind(arg, scope):
     return BoundMethod(method, obj)
 
 def dictionary(arg, scope):
-    dct = Dictionary()
+    data = EMPTY_MAP
 
     while arg is not nil:
         assert type(arg) is Pair
         pair = eval_node(arg.car, scope)
-        dct.set(Pair(ValueNode('CACHE', pair.car), Pair(ValueNode('CACHE', pair.cdr), nil)), scope)
+        data = data.assoc(pair.car, pair.cdr)
         arg = arg.cdr
 
-    return dct
+    return Dictionary(data)
+
+def assoc(arg, scope):
+    assert type(arg) is Pair
+    assert type(arg.cdr) is Pair
+    assert type(arg.cdr.cdr) is Pair
+    assert eval_node(arg.cdr.cdr.cdr, scope) is nil
+    collection = eval_node(arg.car, scope)
+    assert type(collection) is Dictionary or type(collection) is Vector
+    return collection.assoc(eval_node(arg.cdr.car, scope), eval_node(arg.cdr.cdr.car, scope))
+
+def dissoc(arg, scope):
+    assert type(arg) is Pair
+    assert type(arg.cdr) is Pair
+    assert eval_node(arg.cdr.cdr, scope) is nil
+    dct = eval_node(arg.car, scope)
+    assert type(dct) is Dictionary
+    return dct.dissoc(eval_node(arg.cdr.car, scope))
+
+def contains(arg, scope):
+    assert type(arg) is Pair
+    assert type(arg.cdr) is Pair
+    assert eval_node(arg.cdr.cdr, scope) is nil
+    dct = eval_node(arg.car, scope)
+    assert type(dct) is Dictionary
+    return eval_node(arg.cdr.car, scope) in dct.data
 
 def delay(arg, scope):
+    capture(scope)
     return Promise(arg, scope)
 
 def force(arg, scope):
@@ -318,10 +472,61 @@ def force(arg, scope):
     assert type(promise) is Promise
     return promise.get_value()
 
-from core import Pair, Object, nil, Symbol, Dictionary, Promise
-from reader import FormNode, IdentifierNode, ValueNode
-from evaluator import eval_node, Scope, Function, Method, BoundMethod, MultiFunction
+# the stream builtins take their arguments evaluated, as a python list
+def _stream_arguments(arg, scope, min_count, max_count):
+    arguments = list(streams.iterate_stream(eval_node(arg, scope)))
+    assert min_count <= len(arguments) <= max_count
+    return arguments
+
+def stream_map(arg, scope):
+    fn, stream = _stream_arguments(arg, scope, 2, 2)
+    # the rest of the stream is mapped later, in this scope
+    capture(scope)
+    return streams.stream_map(fn, stream, scope)
+
+def stream_filter(arg, scope):
+    arguments = _stream_arguments(arg, scope, 2, 2)
+    predicate = arguments[0]
+    capture(scope)
+    return streams.stream_filter(predicate, arguments.pop(), scope)
+
+def take(arg, scope):
+    count, stream = _stream_arguments(arg, scope, 2, 2)
+    assert type(count) is int
+    return streams.take(count, stream)
+
+def drop(arg, scope):
+    arguments = _stream_arguments(arg, scope, 2, 2)
+    count = arguments[0]
+    assert type(count) is int
+    # popped, so that nothing here keeps the dropped cells alive
+    return streams.drop(count, arguments.pop())
+
+def iterate(arg, scope):
+    fn, value = _stream_arguments(arg, scope, 2, 2)
+    capture(scope)
+    return streams.iterate(fn, value, scope)
+
+def range_(arg, scope):
+    arguments = _stream_arguments(arg, scope, 0, 3)
+    assert all(type(argument) is int for argument in arguments)
+    if not arguments:
+        arguments = [0]
+    return streams.range_stream(*arguments)
+
+def stream_list(arg, scope):
+    stream, = _stream_arguments(arg, scope, 1, 1)
+    return streams.to_list(stream)
+
+from core import Pair, Object, nil, Symbol, Dictionary, Array, Vector, Promise
+from reader import FormNode, IdentifierNode, ValueNode, FoldedNode
+from evaluator import eval_node, Scope, Function, Method, BoundMethod, MultiFunction, Memo, Partial, capture, apply_evaluated
 from patterns import *
 from types import FunctionType
+from hamt import EMPTY_MAP
+from pvector import EMPTY_VECTOR
+import pvector
+import streams
+import sys
 
 default_arguments_pattern_singleton = DefaultArgumentsPattern()
@@ -0,0 +1,119 @@
+# Streams are lists whose cdrs may be promises: x:(delay rest). The ones built here are
+# computed by python, one cell at a time, and everything that walks them does it in a loop,
+# holding on to nothing but the cell it's looking at, so that cells that have been passed
+# over can be freed, and unbounded streams never have to be materialized.
+
+from core import Pair, Promise, nil
+from evaluator import apply_evaluated
+import os
+import mmap
+
+def rest(stream):
+    cdr = stream.cdr
+    if type(cdr) is Promise:
+        return cdr.get_value()
+    return cdr
+
+def iterate_stream(stream):
+    """Yields the elements of a stream (or plain list), forcing it as it goes."""
+    while stream is not nil:
+        assert type(stream) is Pair
+        yield stream.car
+        stream = rest(stream)
+
+def _next_cell(iterator):
+    # only the unforced promise at the end of the stream refers to the iterator, so once nothing
+    # refers to that, the iterator is freed (and a generator's finally blocks run) straight away
+    for item in iterator:
+        return Pair(item, Promise.lazy(lambda: _next_cell(iterator)))
+    return nil
+
+def from_iterable(iterable):
+    """Makes a stream that pulls from a python iterable on demand."""
+    return _next_cell(iter(iterable))
+
+def _mapped_lines(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0: # you can't mmap an empty file
+            return
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+            start = 0
+            size = len(buffer)
+            while start < size:
+                end = buffer.find(b'\n', start)
+                if end == -1:
+                    end = size
+                line = buffer[start:end]
+                if line.endswith(b'\r'):
+                    line = line[:-1]
+                yield line.decode('utf-8')
+                start = end + 1
+
+def file_lines(path):
+    """Makes a stream of the lines of a file, without their line endings. The file is memory-mapped
+    and each line is only decoded when its cell is forced, so a large file never has to be read
+    into memory, let alone turned into a list.
+
+    The file and its mapping stay open while the stream has lines left to force. They're closed
+    when the last line is forced, or as soon as nothing refers to the unforced rest of the stream
+    any more (straight away in CPython, since nothing in the stream refers back to itself)."""
+    return from_iterable(_mapped_lines(path))
+
+def write_lines(file, stream):
+    """Writes each element of a stream (or plain list) to a file on a line of its own, forcing
+    the stream as it goes."""
+    while stream is not nil:
+        assert type(stream) is Pair
+        value = stream.car
+        if type(value) is str:
+            file.write(value)
+        elif type(value) is Pair:
+            value.write(file)
+        else:
+            file.write(str(value))
+        file.write('\n')
+        stream = rest(stream)
+
+def stream_map(fn, stream, scope):
+    if stream is nil:
+        return nil
+    return Pair(apply_evaluated(fn, Pair(stream.car, nil), scope),
+        Promise.lazy(lambda: stream_map(fn, rest(stream), scope)))
+
+def stream_filter(predicate, stream, scope):
+    while stream is not nil and apply_evaluated(predicate, Pair(stream.car, nil), scope) is not True:
+        stream = rest(stream)
+    if stream is nil:
+        return nil
+    return Pair(stream.car, Promise.lazy(lambda: stream_filter(predicate, rest(stream), scope)))
+
+def take(count, stream):
+    if count <= 0 or stream is nil:
+        return nil
+    if count == 1:
+        # forcing the rest could mean searching an unbounded stream for an element we won't use
+        return Pair(stream.car, nil)
+    return Pair(stream.car, Promise.lazy(lambda: take(count - 1, rest(stream))))
+
+def drop(count, stream):
+    while count > 0 and stream is not nil:
+        stream = rest(stream)
+        count -= 1
+    return stream
+
+def iterate(fn, value, scope):
+    return Pair(value, Promise.lazy(lambda: iterate(fn, apply_evaluated(fn, Pair(value, nil), scope), scope)))
+
+def range_stream(start, end = None, step = 1):
+    assert step != 0
+    if end is not None and (start >= end if step > 0 else start <= end):
+        return nil
+    return Pair(start, Promise.lazy(lambda: range_stream(start + step, end, step)))
+
+def to_list(stream):
+    """Materializes a finite stream into an ordinary list."""
+    head = last = Pair(nil, nil)
+    for item in iterate_stream(stream):
+        last.cdr = Pair(item, nil)
+        last = last.cdr
+    return head.cdr
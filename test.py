@@ -1,9 +1,20 @@
 import unittest
-from core import nil, void, Pair
-from reader import lex, read, parse_forms, FormNode, BINARY_OPERATORS, UNARY_OPERATORS, PAIR_CDR_TOKEN, NumericLiteralNode, IdentifierNode, expand_binary_operators, expand_unary_operators, ValueNode
-from evaluator import isheval, root, Scope, Function
+from core import nil, void, Pair, Symbol, Array, Vector, Promise, Object
+from reader import lex, tokenize, read, read_iter, parse_forms, FormNode, FoldedNode, BINARY_OPERATORS, UNARY_OPERATORS, PAIR_CDR_TOKEN, NumericLiteralNode, IdentifierNode, expand_binary_operators, expand_unary_operators, ValueNode
+from evaluator import isheval, isheval_stream, isheval_file, root, Scope, Function, eval_node, compile_node, Frame, get_layout, Layout, UNBOUND, fold_constants
 from types import LambdaType, FunctionType
 import specials
+import streams
+import hamt
+import pvector
+from patterns import PatternMatchError, NoMatchingClauseError
+import io
+import itertools
+import gc
+import random
+import sys
+import os
+import tempfile
 
 def read_one(code):
     return read(code)[0]
@@ -20,6 +31,7 @@ class Tests(unittest.TestCase):
             initial_scope = {}
         scope = Scope(initial_scope, root)
         self.assertFalse(isheval(pattern_code).match(isheval(target_code), scope))
+        self._test_compiled_pattern(pattern_code, target_code, None)
 
     def _test_pattern(self, pattern_code, target_code, expected_scope, initial_scope = None):
         if initial_scope is None:
@@ -30,6 +42,21 @@ class Tests(unittest.TestCase):
         self.assertEqual(scope.identifiers(), expected_scope.keys())
         for key in expected_scope:
             self.assertEqual(expected_scope[key], scope.get(key))
+        self._test_compiled_pattern(pattern_code, target_code, expected_scope)
+
+    # compiled matchers should agree with match, whether or not they know the frame layout
+    def _test_compiled_pattern(self, pattern_code, target_code, expected_scope):
+        pattern = isheval(pattern_code)
+        layout = get_layout(list(dict.fromkeys(pattern.identifiers())), root)
+        for scope, matcher in [(Scope({}, root), pattern.compile()), (Frame(layout, root), pattern.compile(layout))]:
+            matched = matcher(isheval(target_code), scope)
+            if expected_scope is None:
+                self.assertFalse(matched)
+            else:
+                self.assertTrue(matched)
+                self.assertEqual(set(scope.identifiers()), set(expected_scope.keys()))
+                for key in expected_scope:
+                    self.assertEqual(expected_scope[key], scope.get(key))
 
     def test_scope(self):
         parent = Scope({}, None)
@@ -47,7 +74,37 @@ class Tests(unittest.TestCase):
         self.assertRaises(Exception, child.get, 'baz')
 
 
-    # repr tests
+    def test_frame(self):
+        layout = get_layout(['frame-a', 'frame-b'], root)
+        frame = Frame(layout, root)
+        self.assertFalse(frame.has('frame-a'))
+        frame.set('frame-a', 1)
+        frame.set('frame-c', 3)
+        self.assertTrue(frame.has('frame-a'))
+        self.assertTrue(frame.has('frame-c'))
+        self.assertFalse(frame.has('frame-b'))
+        self.assertEqual(1, frame.get('frame-a'))
+        self.assertEqual(3, frame.get('frame-c'))
+        self.assertEqual(specials.add, frame.get('add'))
+        self.assertEqual({'frame-a', 'frame-c'}, frame.identifiers())
+        self.assertEqual([1, UNBOUND], frame.slots)
+        self.assertRaises(Exception, frame.get, 'frame-b')
+
+    def test_layouts_are_shared(self):
+        make = isheval('(fn [x] (fn [y] (add x y)))')
+        scope = Scope({'make': make}, root)
+        self.assertIs(isheval('(make 1)', scope).layout, isheval('(make 2)', scope).layout)
+        self.assertEqual((1, 0), isheval('(make 1)', scope).layout.resolve('x'))
+        self.assertEqual(None, isheval('(make 1)', scope).layout.resolve('add'))
+    def test_layouts_go_away_with_their_scope(self):
+        def count_layouts():
+            gc.collect()
+            return sum(1 for obj in gc.get_objects() if type(obj) is Layout)
+        before = count_layouts()
+        for _ in range(100):
+            isheval('(def short-lived (fn [n] n)) (short-lived 1)', Scope({}, root))
+        self.assertLess(count_layouts() - before, 10)
+
 
     def test_list_repr_empty_lists_are_nil(self):
         self.assertEqual('(_list)', repr(read_one('[]')))
@@ -95,6 +152,23 @@ class Tests(unittest.TestCase):
         self.assertRaises(Exception, isheval, '(list | [4 5 6])')
     def test_eval_literals(self):
         self.assertEqual(10, isheval('10'))
+    def test_compiled_nodes_are_cached(self):
+        node = read_one('(add 1 (add 2 3))')
+        self.assertEqual(6, eval_node(node, root))
+        code = node.code
+        self.assertIsNotNone(code)
+        self.assertIs(code, compile_node(node))
+        self.assertEqual(6, eval_node(node, root))
+        self.assertIs(code, node.code)
+    def test_compiled_nodes_look_up_identifiers_every_time(self):
+        node = read_one('(f 1)')
+        scope = Scope({'f': isheval('(fn [x] x)')}, root)
+        self.assertEqual(1, eval_node(node, scope))
+        scope.set('f', isheval('(fn [x] (add x 1))'))
+        self.assertEqual(2, eval_node(node, scope))
+    def test_compiled_symbols(self):
+        self.assertEqual(Symbol('foo'), isheval('#foo'))
+        self.assertEqual(Symbol('foo'), isheval('((fn - #foo))'))
     def test_eval_functions(self):
         self.assertEqual(20, isheval('((fn x 20))'))
         self.assertEqual(5, isheval('((fn x x) | 5)'))
@@ -124,6 +198,44 @@ class Tests(unittest.TestCase):
         self.assertEqual(compose, isheval('compose', scope))
         self.assertEqual(10, isheval('((compose id id) 10)', scope))
         self.assertEqual(Pair(10, nil), isheval('((compose id id) [10])', scope))
+    def test_lexically_addressed_closures(self):
+        self.assertEqual(6, isheval('((((fn [x] (fn [y] (fn [z] (add x (add y z))))) 1) 2) 3)'))
+        self.assertEqual(10, isheval('((fn [x] ((fn - (def x 10) x))) 1)'))
+        self.assertEqual(10, isheval('((fn [x] ((fn - (redef x 10))) x) 1)'))
+        self.assertEqual(12, isheval('''
+            (counter = ((fn [n] (fn - (redef n (add n 1)))) 0))
+            (counter)
+            (add 10 (counter))
+            '''))
+    def test_global_lookups_see_redefinitions(self):
+        scope = Scope({}, root)
+        isheval('''
+            (def glob 1)
+            (def read-glob (fn - ((fn - glob))))''', scope)
+        self.assertEqual(Pair(1, Pair(1, nil)), isheval('[(read-glob) glob]', scope))
+        isheval('(def glob 2)', scope)
+        self.assertEqual(Pair(2, Pair(2, nil)), isheval('[(read-glob) glob]', scope))
+        isheval('(redef glob 3)', scope)
+        self.assertEqual(Pair(3, Pair(3, nil)), isheval('[(read-glob) glob]', scope))
+        scope.set('glob', 4)
+        self.assertEqual(Pair(4, Pair(4, nil)), isheval('[(read-glob) glob]', scope))
+        # the same node evaluated in another scope
+        self.assertEqual(5, isheval('glob', Scope({'glob': 5}, scope)))
+    def test_global_lookups_see_runtime_shadowing(self):
+        isheval('''
+            (def shadowed 0)
+            (def make-reader (fn [x] (def shadowed x) (fn - shadowed)))
+            (reader-a = (make-reader 1))
+            (reader-b = (make-reader 2))''')
+        self.assertEqual(Pair(1, Pair(2, Pair(0, nil))), isheval('[(reader-a) (reader-b) shadowed]'))
+        # frame slots change without a set, so nothing looked up through one gets cached
+        frame = Frame(get_layout(['frame-x'], root), root)
+        frame.set('frame-x', 1)
+        scope = Scope({}, frame)
+        scope.set('read-frame-x', isheval('(fn - frame-x)', scope))
+        self.assertEqual(Pair(1, Pair(1, nil)), isheval('[(read-frame-x) frame-x]', scope))
+        frame.slots[0] = 2
+        self.assertEqual(Pair(2, Pair(2, nil)), isheval('[(read-frame-x) frame-x]', scope))
     def test_function_patterns_simple(self):
         compose = isheval('(fn [fn1 fn2] (fn [y] (fn2 (fn1 y))))')
         scope = Scope({'compose': compose}, root)
@@ -158,6 +270,22 @@ class Tests(unittest.TestCase):
         self.assertEqual(15, isheval('(#(add -1 -2) 5 10)'))
         self.assertEqual(void, isheval('(#(id -))'))
         self.assertRaises(Exception, isheval, '(#(add -1 -2) 5)')
+    def test_tail_calls_dont_grow_the_stack(self):
+        self.assertEqual(Symbol('done'), isheval('''
+            (def count-down (fn [n] (if (eq n 0) #done (count-down (subtract n 1)))))
+            (count-down 20000)'''))
+        self.assertEqual(20000, isheval('''
+            (def build (fn [n acc] (if (eq n 0) acc (build (subtract n 1) n:acc))))
+            (def len (mfn
+                ([[] acc] acc)
+                ([x:xs acc] (len xs (add acc 1)))))
+            (len (build 20000 []) 0)'''))
+    def test_tail_calls_through_methods(self):
+        self.assertEqual(0, isheval('''
+            (obj = { loop: (md [n] (if (eq n 0) n (this.loop (subtract n 1)))) })
+            (obj.loop 20000)'''))
+    def test_multi_function_body_errors_propagate(self):
+        self.assertRaises(Exception, isheval, '((mfn ([a] (car a)) ([a] 10)) 5)')
     def test_eval_builtins(self):
         self.assertEqual(1, isheval('(car [1])'))
         self.assertEqual(1, isheval('(car (id [1]))'))
@@ -185,6 +313,80 @@ class Tests(unittest.TestCase):
         self.assertEqual(Pair(5, Pair(10, Pair(20, nil))), isheval('(curried 10 20)', scope))
         self.assertEqual(1, count)
 
+    def test_curry_makes_partials(self):
+        scope = Scope({}, root)
+        isheval('''
+            (def one-and (curry list 1))
+            (def pair-up (fn [a b] a:b))
+            (def describe (mfn ([0 x] #zero:x) ([n x] n:x)))
+            (obj = { base: 10, plus: (md [a b] (add @base (add a b))) })
+            (def count-down (fn [result n] (if (eq n 0) result (again (subtract n 1)))))
+            (def again (curry count-down #done))''', scope)
+        self.assertEqual(Pair(1, Pair(Pair(1, Pair(2, nil)), nil)), isheval('(one-and (one-and 2))', scope))
+        self.assertEqual(Pair(1, nil), isheval('(one-and)', scope))
+        self.assertEqual(Pair(1, 2), isheval('((curry pair-up 1) 2)', scope))
+        self.assertEqual(Pair(Symbol('zero'), 5), isheval('((curry describe 0) 5)', scope))
+        self.assertEqual(16, isheval('((curry obj.plus 1) 5)', scope))
+        self.assertEqual(Symbol('done'), isheval('(again 5000)', scope))
+        self.assertEqual(Pair(1, Pair(2, Pair(3, nil))), isheval('(apply (curry one-and 2) [3])', scope))
+        self.assertEqual(Pair(1, Pair(2, nil)), isheval('(call one-and 2)', scope))
+        nested = isheval('(curry (curry (curry list 1) 2) 3)', scope)
+        self.assertIs(specials.list_, nested.fn)
+        self.assertEqual((1, 2, 3), nested.arguments)
+        # a curried builtin still decides which of its arguments get evaluated
+        noted = []
+        def note(arg, scope):
+            noted.append(eval_node(arg.car, scope))
+            return noted[-1]
+        scope.set('note', note)
+        self.assertEqual(1, isheval('(def when-true (curry if true)) (when-true (note 1) (note 2))', scope))
+        self.assertEqual([1], noted)
+    def test_memo(self):
+        isheval('''(def memo-fib (memo (mfn
+            ([0] 0)
+            ([1] 1)
+            ([n] (add (memo-fib (subtract n 1)) (memo-fib (subtract n 2)))))))''')
+        self.assertEqual(354224848179261915075, isheval('(memo-fib 100)'))
+        self.assertEqual(Pair(98, Pair(101, Pair(101, nil))),
+            isheval('[memo-fib.hits memo-fib.misses memo-fib.size]'))
+
+    def test_memo_evicts_least_recently_used(self):
+        isheval('(def memo-list (memo list 2))')
+        for n in [1, 2, 1, 3, 2]:
+            self.assertEqual(Pair(n, nil), isheval('(memo-list %d)' % n))
+        self.assertEqual(Pair(1, Pair(4, Pair(2, nil))),
+            isheval('[memo-list.hits memo-list.misses memo-list.size]'))
+        self.assertEqual(Pair(Pair(1, nil), Pair(1, nil)), isheval('[(memo-list 1) memo-list.hits]'))
+
+    def test_memo_passes_unhashable_arguments_through(self):
+        isheval('(def memo-length (memo (fn [a] (length a))))')
+        self.assertEqual(2, isheval('(memo-length #[1 2])'))
+        self.assertEqual(2, isheval('(memo-length #[1 2])'))
+        self.assertEqual(Pair(0, Pair(0, nil)), isheval('[memo-length.hits memo-length.size]'))
+
+    def test_memo_hashes_each_argument_once(self):
+        class Counted:
+            hashes = 0
+            def __hash__(self):
+                Counted.hashes += 1
+                return 0
+        isheval('(def memo-count (memo (fn [a] 1)))')
+        memo = isheval('memo-count')
+        arg = ValueNode('_constant', Pair(Counted(), nil))
+        self.assertEqual(1, memo.call(arg, root))
+        self.assertEqual(1, Counted.hashes)
+        self.assertEqual(1, memo.call(arg, root))
+        self.assertEqual(2, Counted.hashes)
+        self.assertEqual(Pair(1, Pair(1, nil)), isheval('[memo-count.hits memo-count.misses]'))
+
+    def test_pair_hash(self):
+        self.assertEqual(hash(Pair(1, Pair(2, nil))), hash(Pair(1, Pair(2, nil))))
+        self.assertEqual(1, len({Pair(1, Pair(2, nil)), Pair(1, Pair(2, nil))}))
+        lst = nil
+        for i in range(100000):
+            lst = Pair(i, lst)
+        self.assertIsInstance(hash(lst), int)
+
     # lex tests
 
     def test_lex_bare_literals(self):
@@ -202,6 +404,17 @@ class Tests(unittest.TestCase):
         self.assertEqual(['a', ':', ':', 'b'], lex('a: :b'))
         self.assertEqual(['a', '::', 'b'], lex('a::b'))
 
+    def test_lex_whitespace_and_commas(self):
+        self.assertEqual(['{', 'a', ':', '1', 'b', ':', '2', '}'], lex('{ a: 1,\tb:2\n}'))
+        self.assertEqual([], lex(' ,\n'))
+
+    def test_lex_matched_tokens(self):
+        self.assertEqual(['#[', '1', ']', '#(', 'a', ')', '#{', '}', '#foo'], lex('#[1]#(a)#{}#foo'))
+        self.assertEqual(['a', '#(', ')'], lex('a#()'))
+
+    def test_tokenize_reports_offsets(self):
+        self.assertEqual([('(', 0), ('add', 1), ('1', 5), ('#foo', 8), (')', 12)], list(tokenize('(add 1, #foo)')))
+
     # read tests
 
     def test_expand_unary_operators(self):
@@ -367,6 +580,62 @@ class Tests(unittest.TestCase):
             ),
             read_one('(print [(add 10 20)])'))
 
+    def test_read_many_top_level_forms(self):
+        forms = read('(add 1 2) ' * 20000)
+        self.assertEqual(20000, len(forms))
+        self.assertEqual(Forms(IdentifierNode('add'), NumericLiteralNode('1'), NumericLiteralNode('2')), forms[-1])
+    def test_read_deep_nesting(self):
+        node = read_one('(' * 5000 + 'a' + ')' * 5000)
+        depth = 0
+        while type(node) is FormNode:
+            node = node.car
+            depth += 1
+        self.assertEqual(5000, depth)
+        self.assertEqual(IdentifierNode('a'), node)
+    def test_read_long_lists_and_operator_chains(self):
+        items = read_one('[' + ' 1' * 20000 + ' 2]').cdr
+        length = 0
+        while items.cdr is not nil:
+            items = items.cdr
+            length += 1
+        self.assertEqual(20000, length)
+        self.assertEqual(NumericLiteralNode('2'), items.car)
+        node = read_one('1' + ':2' * 20000)
+        length = 0
+        while type(node) is FormNode:
+            node = node.cdr.cdr.car
+            length += 1
+        self.assertEqual(20000, length)
+    def test_read_unbalanced(self):
+        self.assertRaises(Exception, read, '(a')
+        self.assertRaises(Exception, read, '[(])')
+        self.assertRaises(Exception, read, '~')
+        self.assertEqual(Forms(IdentifierNode('a'), IdentifierNode(']')), read_one('(a ])'))
+
+    def test_read_iter_matches_read(self):
+        for code in ['(add 1 2) (print a:b:c)', 'a:b c.d ~e @f', '#{5: 10}.5 [1 2 | 3]', '(a::b = c) x/y', '']:
+            for chunk_size in [1, 2, 3, 1000]:
+                self.assertEqual(read(code), list(read_iter(io.StringIO(code), chunk_size)))
+                self.assertEqual(read(code), list(read_iter(io.BytesIO(code.encode('utf-8')), chunk_size)))
+            self.assertEqual(read(code), list(read_iter(code)))
+    def test_read_iter_decodes_split_characters(self):
+        self.assertEqual([IdentifierNode('\u00e9\u00e9')], list(read_iter(io.BytesIO('\u00e9\u00e9'.encode('utf-8')), 1)))
+    def test_read_iter_is_lazy(self):
+        source = io.StringIO('(a) ' * 10000)
+        forms = read_iter(source, 16)
+        self.assertEqual(FormNode(IdentifierNode('a'), nil), next(forms))
+        self.assertTrue(source.tell() < 100)
+    def test_isheval_stream(self):
+        self.assertEqual(15, isheval_stream(io.StringIO('(stream-a = 10) (add stream-a 5)')))
+    def test_isheval_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.ish')
+            with open(path, 'w') as f:
+                f.write('(file-a = 10)\n(add file-a 5)\n')
+            self.assertEqual(15, isheval_file(path))
+            open(path, 'w').close()
+            self.assertEqual(nil, isheval_file(path))
+
     # pattern tests
 
     def test_pattern_allows_empty_square_brackets_as_nil(self):
@@ -618,13 +887,70 @@ class Tests(unittest.TestCase):
             (obj = {foo: {bar: 10}})
             (get {obj.foo.bar} bar)
             '''))
+    def test_objects_share_shapes(self):
+        a = isheval('{foo: 1, bar: 2}')
+        b = isheval('{foo: 3, bar: 4}')
+        self.assertIs(a.shape, b.shape)
+        self.assertIsNot(a.shape, isheval('{bar: 1, foo: 2}').shape)
+        self.assertEqual({'foo': 1, 'bar': 2}, a.slot_dict())
+    def test_prototype_chains(self):
+        # there's no way to make a prototype chain in ishlisp yet, so they're made here
+        root.set('proto-top', Object(Object(isheval('{ baz: 5, meth: (md [a] (add a @baz)) }'))))
+        self.assertEqual(Pair(6, Pair(5, Pair(1, nil))), isheval('''
+            (set proto-top qux 1)
+            [(proto-top.meth 1) proto-top.baz proto-top.qux]'''))
+        self.assertRaises(Exception, isheval, 'proto-top.missing')
+    def test_get_sites_notice_prototypes_changing(self):
+        root.set('cache-mid', Object(isheval('{ foo: 1, meth: (md - 1) }')))
+        root.set('cache-top', Object(isheval('cache-mid')))
+        isheval('''
+            (def cache-get (fn [o] [o.foo (o.meth)]))''')
+        self.assertEqual(Pair(1, Pair(1, nil)), isheval('(cache-get cache-top)'))
+        self.assertEqual(Pair(1, Pair(1, nil)), isheval('(cache-get cache-top)'))
+        isheval('(set cache-mid foo 2) (set cache-mid meth (md - 2))')
+        self.assertEqual(Pair(2, Pair(2, nil)), isheval('(cache-get cache-top)'))
+        isheval('(set cache-top foo 3)')
+        self.assertEqual(Pair(3, Pair(2, nil)), isheval('(cache-get cache-top)'))
+        self.assertEqual(Pair(2, Pair(2, nil)), isheval('(cache-get cache-mid)'))
+        self.assertEqual(Pair(5, Pair(6, nil)), isheval('(cache-get { foo: 5, meth: (fn - 6) })'))
+    def test_get_sites_handle_other_types(self):
+        self.assertEqual(Pair(1, Pair(2, Pair(3, nil))), isheval('''
+            (def site-get (fn [o] o.car))
+            [(site-get {car: 1}) (site-get 2:3) (site-get { car: 3 })]'''))
+
+    # symbol tests
+
+    def test_symbols_are_interned(self):
+        self.assertIs(Symbol('foo'), Symbol('foo'))
+        self.assertIs(Symbol('foo'), isheval('#foo'))
+        self.assertNotEqual(Symbol('foo'), Symbol('bar'))
+        self.assertNotEqual(Symbol('foo'), 'foo')
+        self.assertEqual(True, isheval('(eq #foo #foo)'))
+        self.assertEqual(False, isheval('(eq #foo #bar)'))
+    def test_unused_symbols_are_freed(self):
+        before = len(Symbol.table)
+        for i in range(1000):
+            isheval('#generated-symbol-%d' % i)
+        gc.collect()
+        self.assertLess(len(Symbol.table) - before, 10)
+        kept = Symbol('kept-symbol')
+        gc.collect()
+        self.assertIs(kept, isheval('#kept-symbol'))
+    def test_symbols_as_dictionary_keys(self):
+        self.assertEqual(10, isheval('#{#foo: 10, #bar: 20}.#foo'))
 
     # dictionary tests
 
     def test_dictionaries_basic(self):
         self.assertEqual(10, isheval('(get (dictionary 5:10) 5)'))
-    def test_dictionaries_set(self):
-        self.assertEqual(10, isheval('(dict = (dictionary)) (set dict 5 10) (get dict 5)'))
+    def test_dictionaries_are_immutable(self):
+        self.assertEqual(10, isheval('(dict = (dictionary)) (dict = (assoc dict 5 10)) (get dict 5)'))
+        self.assertRaises(Exception, isheval, '(dict = (dictionary)) (set dict 5 10)')
+        self.assertEqual(True, isheval('''
+            (key-dict = (dictionary))
+            (outer = (assoc #{} key-dict 1))
+            (set key-dict foo 20)
+            (contains? outer key-dict)'''))
     def test_dictionaries_special_syntax(self):
         self.assertEqual(10, isheval('(get #{5: 10} 5)'))
     def test_dictionaries_get_syntax(self):
@@ -635,12 +961,104 @@ class Tests(unittest.TestCase):
             #{foo: 10}.5'''))
     def test_dictionaries_can_still_have_attributes(self):
         self.assertEqual(Pair(10, Pair(20, 30)), isheval('''
-            (dict = (dictionary))
-            (set dict 5 10)
+            (dict = #{5: 10, #foo: 30})
             (set dict foo 20)
-            (set dict #foo 30)
             dict.5 : dict.foo : dict.#foo'''))
 
+    def test_dictionaries_are_persistent(self):
+        self.assertEqual(Pair(False, Pair(3, Pair(True, Pair(2, nil)))), isheval('''
+            (d = #{1: 2})
+            (e = (assoc d [1 2] 3))
+            [(contains? d [1 2]) (get e [1 2]) (eq (dissoc e [1 2]) d) (get e 1)]'''))
+        self.assertEqual(10, isheval('(get #{#{1: [2]}: 10} (assoc #{} 1 [2]))'))
+    def test_persistent_maps(self):
+        rng = random.Random(4)
+        versions = [(hamt.EMPTY_MAP, {})]
+        for _ in range(3000):
+            data, expected = versions[rng.randrange(len(versions))]
+            key = rng.randrange(500)
+            if rng.random() < 0.7:
+                data = data.assoc(key, key * 2)
+                expected = dict(expected, **{str(key): key * 2})
+            else:
+                data = data.dissoc(key)
+                expected = {k: v for k, v in expected.items() if k != str(key)}
+            versions.append((data, expected))
+        for data, expected in versions:
+            self.assertEqual(len(expected), len(data))
+            self.assertEqual(expected, {str(key): value for key, value in data.items()})
+            self.assertEqual(data, hamt.from_items(data.items()))
+            self.assertEqual(hash(data), hash(hamt.from_items(reversed(list(data.items())))))
+    def test_persistent_map_collisions(self):
+        class Colliding:
+            def __init__(self, n):
+                self.n = n
+            def __eq__(self, other):
+                return type(other) is Colliding and self.n == other.n
+            def __hash__(self):
+                return 7
+        data = hamt.from_items((Colliding(n), n) for n in range(10))
+        self.assertEqual(list(range(10)), sorted(data.get(Colliding(n)) for n in range(10)))
+        smaller = data.dissoc(Colliding(3))
+        self.assertNotIn(Colliding(3), smaller)
+        self.assertIn(Colliding(3), data)
+        self.assertEqual(9, len(smaller))
+        self.assertEqual(data, smaller.assoc(Colliding(3), 3))
+
+    # array tests
+
+    def test_array_literals(self):
+        self.assertEqual(Array([1, 2, 3]), isheval('#[1 (add 1 1) 3]'))
+        self.assertEqual(Array([]), isheval('#[]'))
+        self.assertEqual('#[1 #foo]', repr(isheval('#[1 #foo]')))
+        self.assertRaises(Exception, isheval, '#[1 | 2]')
+    def test_arrays_get_and_set(self):
+        self.assertEqual(20, isheval('#[10 20 30].1'))
+        self.assertEqual(30, isheval('(get #[10 20 30] (add 1 1))'))
+        self.assertEqual(3, isheval('#[10 20 30].length'))
+        self.assertEqual(Array([10, 5]), isheval('(arr = #[10 20]) (set arr 1 5) arr'))
+    def test_array_builtins(self):
+        self.assertEqual(3, isheval('(length #[1 2 3])'))
+        self.assertEqual(3, isheval('(length [1 2 3])'))
+        self.assertEqual(0, isheval('(length [])'))
+        self.assertEqual(Array([2, 3]), isheval('(slice #[1 2 3 4] 1 3)'))
+        self.assertEqual(Array([3, 4]), isheval('(slice #[1 2 3 4] 2)'))
+        self.assertEqual(Array([1, 2]), isheval('(arr = #[1]) (append arr 2) arr'))
+    def test_array_patterns(self):
+        self._test_pattern('(pattern [a b])', '#[1 2]', {'a': 1, 'b': 2})
+        self._test_pattern('(pattern [a | b])', '#[1 2 3]', {'a': 1, 'b': Array([2, 3])})
+        self._test_pattern('(pattern [a | b])', '#[1]', {'a': 1, 'b': nil})
+        self._test_pattern('(pattern [a b = 20])', '#[1]', {'a': 1, 'b': 20})
+        self._test_pattern('(pattern x:xs)', '#[1 2]', {'x': 1, 'xs': Array([2])})
+        self._test_pattern_fails('(pattern [a b])', '#[1 2 3]')
+        self._test_pattern_fails('(pattern [a b])', '#[1]')
+        self.assertEqual(6, isheval('''
+            (def sum (mfn
+                ([[]] 0)
+                ([x:xs] (add x (sum xs)))))
+            (sum #[1 2 3])'''))
+    def test_array_rests_share_items_until_changed(self):
+        arr = isheval('#[1 2 3 4]')
+        rest = isheval('(mfn ([x:xs] xs))', root).call(Pair(ValueNode('_arr', arr), nil), root)
+        self.assertIs(arr.items, rest.items)
+        self.assertEqual(Array([2, 3, 4]), rest)
+        self.assertEqual(Array([3]), isheval('(slice rest 1 2)', Scope({'rest': rest}, root)))
+        self.assertEqual(Pair(4, Pair(4, Pair(3, nil))), isheval('''
+            (set rest 1 20)
+            (append rest 5)
+            [(length rest) rest.2 arr.2]''', Scope({'rest': rest, 'arr': arr}, root)))
+        self.assertEqual(Array([2, 20, 4, 5]), rest)
+        self.assertEqual('#[2 20 4 5]', repr(rest))
+        self.assertEqual(Array([1, 2, 3, 4]), arr)
+        self.assertEqual(Pair(Array([1, 2, 3, 9]), Pair(Array([2, 3]), nil)), isheval('''
+            (cow-arr = #[1 2 3])
+            (def cow-tail (mfn ([x:xs] xs)))
+            (cow-rest = (cow-tail cow-arr))
+            (append cow-arr 9)
+            [cow-arr cow-rest]'''))
+    def test_default_arguments_pattern_with_arrays(self):
+        self.assertEqual(3, isheval('(#(add -1 -2) | #[1 2])'))
+
     # test methods
 
     def test_binding_methods(self):
@@ -655,6 +1073,176 @@ class Tests(unittest.TestCase):
     def test_cant_invoke_unbound_method(self):
         self.assertRaises(Exception, isheval, '((md - 10) 5)')
 
+    # test constant folding
+
+    def test_constant_folding(self):
+        node = fold_constants(read_one('(list (add 1 2) [#a (subtract 5 1)] 1:2 (eq 1 1) (even? 3) (odd? 3))'))
+        self.assertIs(FoldedNode, type(node))
+        self.assertEqual(Pair(3, Pair(Pair(Symbol('a'), Pair(4, nil)), Pair(Pair(1, 2), Pair(True, Pair(False, Pair(True, nil)))))), node.value)
+        self.assertEqual(['list', 'add', 'subtract', 'eq', 'even?', 'odd?'], sorted(set(head.identifier for head, _ in node.guards), key = repr(node).index))
+        self.assertEqual('(list (add 1 2) (_list #a (subtract 5 1)) (_cons 1 2) (eq 1 1) (even? 3) (odd? 3))', repr(node))
+        self.assertEqual(node.value, isheval('(list (add 1 2) [#a (subtract 5 1)] 1:2 (eq 1 1) (even? 3) (odd? 3))', root))
+    def test_constant_folding_leaves_other_forms(self):
+        self.assertIs(FormNode, type(fold_constants(read_one('(add 1 x)'))))
+        self.assertIs(FormNode, type(fold_constants(read_one('(print 1)'))))
+        self.assertIs(FormNode, type(fold_constants(read_one('(add 1 #foo)'))))
+        self.assertIs(FormNode, type(fold_constants(read_one('(list | [4 5 6])'))))
+        self.assertIs(FoldedNode, fold_constants(read_one('(print [1 2])')).cdr.car.__class__)
+    def test_constant_folding_respects_redefinition(self):
+        scope = Scope({}, root)
+        isheval('(def fold-sum (fn - (add 1 (subtract 3 1))))', scope)
+        self.assertEqual(3, isheval('(fold-sum)', scope))
+        isheval('(def subtract (fn [a b] (add a b)))', scope)
+        self.assertEqual(5, isheval('(fold-sum)', scope))
+        self.assertEqual(Pair(1, Pair(2, nil)), isheval('((fn [add] (add 1 2)) list)', scope))
+    def test_folded_forms_are_still_patterns(self):
+        self.assertEqual(Pair(1, Pair(2, nil)), isheval('''
+            (def fold-match (mfn ([[0]] 1) ([[1 2]] 2) (- 3)))
+            [(fold-match #[0]) (fold-match [1 2])]''', root))
+
+    # vector tests
+
+    def test_vectors(self):
+        self.assertEqual(Vector(pvector.from_iterable([1, 2, 3])), isheval('(vector 1 (add 1 1) 3)'))
+        self.assertEqual(Pair(Vector(pvector.from_iterable([1, 2, 3])), Vector(pvector.from_iterable([1, 5, 3, 4]))), isheval('''
+            (v = (vector 1 2 3))
+            v : (append (assoc v 1 5) 4)'''))
+        self.assertEqual(Pair(2, Pair(3, Pair(2, nil))), isheval('((fn [v] [v.1 v.length (get v (subtract 0 2))]) (vector 1 2 3))'))
+        self.assertEqual(Pair(Vector(pvector.from_iterable([3, 4])), Vector(pvector.from_iterable([2, 3]))), isheval('''
+            (v = (vector 1 2 3 4))
+            (slice v 2) : (slice v 1 3)'''))
+        self.assertEqual('(vector)', repr(isheval('(vector)')))
+        self.assertRaises(Exception, isheval, '(set (vector 1) 0 2)')
+    def test_vector_patterns(self):
+        scope = Scope({}, root)
+        self.assertEqual(Pair(1, Pair(Vector(pvector.from_iterable([2, 3])), nil)), isheval('((fn [[x | xs]] [x xs]) (vector 1 2 3))', scope))
+        self.assertEqual(6, isheval('''
+            (def sum (mfn ([[]] 0) ([[x | xs]] (add x (sum xs)))))
+            (sum (vector 1 2 3))''', scope))
+        self.assertEqual(5, isheval('(#(add -1 -3) | (vector 1 2 4))', scope))
+        self.assertEqual(3, isheval('((fn [a b] (add a b)) | (vector 1 2))', scope))
+        self.assertIs(isheval('(def shared (vector 1 2 3))', scope).data, isheval('((fn [[_ | xs]] xs) shared)', scope).data)
+    def test_persistent_vectors(self):
+        rng = random.Random(7)
+        versions = [(pvector.EMPTY_VECTOR, [])]
+        for _ in range(2000):
+            vector, expected = versions[rng.randrange(len(versions))]
+            if expected and rng.random() < 0.4:
+                index = rng.randrange(len(expected))
+                vector = vector.assoc(index, -index)
+                expected = expected[:index] + [-index] + expected[index + 1:]
+            else:
+                for _ in range(rng.choice([1, 1, 40])):
+                    vector = vector.append(len(expected))
+                    expected = expected + [len(expected)]
+            versions.append((vector, expected))
+        for vector, expected in versions:
+            self.assertEqual(expected, list(vector))
+            self.assertEqual(len(expected), len(vector))
+            if expected:
+                self.assertEqual(expected[-1], vector[-1])
+    def test_transient_vectors(self):
+        base = pvector.from_iterable(range(2000))
+        transient = base.transient()
+        for i in range(0, 2000, 3):
+            transient.assoc(i, 'x')
+        for i in range(100):
+            transient.append(i)
+        result = transient.persistent()
+        self.assertEqual(list(range(2000)), list(base))
+        self.assertEqual(['x' if i % 3 == 0 else i for i in range(2000)] + list(range(100)), list(result))
+        self.assertRaises(Exception, transient.append, 1)
+        # a second transient doesn't get to change nodes the first one made
+        again = result.transient()
+        again.assoc(0, 'y')
+        self.assertEqual('x', result[0])
+        self.assertEqual('y', again.persistent()[0])
+
+    # test argument binding
+
+    def test_arguments_bind_without_a_list(self):
+        scope = Scope({}, root)
+        isheval('''
+            (def three (fn [a b c=3] [a b c]))
+            (def rest (fn [a | more] more))
+            (def everything #(id --))''', scope)
+        self.assertIsNotNone(isheval('three', scope).items_matcher)
+        self.assertIsNone(isheval('everything', scope).items_matcher)
+        self.assertEqual(Pair(1, Pair(2, Pair(3, nil))), isheval('(three 1 2)', scope))
+        self.assertRaises(PatternMatchError, isheval, '(three 1)', scope)
+        self.assertEqual(Pair(1, Pair(2, Pair(4, nil))), isheval('(three 1 | [2 4])', scope))
+        self.assertEqual(Pair(2, Pair(3, nil)), isheval('(rest 1 2 3)', scope))
+        self.assertEqual(nil, isheval('(rest 1)', scope))
+        self.assertEqual(Pair(1, Pair(2, nil)), isheval('(everything 1 2)', scope))
+        with self.assertRaises(PatternMatchError) as context:
+            isheval('(three 1 2 3 4)', scope)
+        self.assertEqual(Pair(1, Pair(2, Pair(3, Pair(4, nil)))), context.exception.target)
+
+    # test long lists
+
+    def long_list(self, length):
+        lst = nil
+        for i in range(length - 1, -1, -1):
+            lst = Pair(i, lst)
+        return lst
+    def test_long_lists(self):
+        length = sys.getrecursionlimit() * 10
+        scope = Scope({'a': self.long_list(length), 'b': self.long_list(length)}, root)
+        self.assertTrue(isheval('(eq a b)', scope))
+        self.assertEqual(self.long_list(length), isheval('(cdr (list 7 | a))', scope))
+        self.assertNotEqual(self.long_list(length), self.long_list(length - 1))
+        self.assertEqual(hash(scope.get('a')), hash(scope.get('b')))
+        text = repr(scope.get('a'))
+        self.assertTrue(text.startswith('(Pair 0 (Pair 1 (Pair 2 '))
+        self.assertTrue(text.endswith('(Pair %d nil' % (length - 1) + ')' * length))
+        self.assertEqual(text, str(scope.get('a')))
+        self.assertEqual(self.long_list(length), eval_node(Pair(ValueNode('_zero', 0), self.long_list(length).cdr), scope))
+        code = '[%s]' % ' '.join(map(str, range(length)))
+        self.assertEqual(code.replace('[', '(_list ').replace(']', ')'), repr(read_one(code)))
+        self.assertEqual(self.long_list(length), isheval(code, scope))
+    def test_print_streams_lists(self):
+        out = io.StringIO()
+        scope = Scope({'a': self.long_list(3), 'b': self.long_list(sys.getrecursionlimit() * 10)}, root)
+        stdout = sys.stdout
+        sys.stdout = out
+        try:
+            isheval('(print a) (print #foo) (print b)', scope)
+        finally:
+            sys.stdout = stdout
+        lines = out.getvalue().split('\n')
+        self.assertEqual(['(Pair 0 (Pair 1 (Pair 2 nil)))', '#foo', str(scope.get('b')), ''], lines)
+
+    # test frame recycling
+
+    def test_frames_are_recycled(self):
+        scope = Scope({}, root)
+        leaf = isheval('(def leaf (fn [x] (add x 1)))', scope)
+        self.assertEqual(2, isheval('(leaf 1)', scope))
+        self.assertEqual(1, len(leaf.layout.free_frames))
+        frame = leaf.layout.free_frames[0]
+        self.assertEqual(3, isheval('(leaf 2)', scope))
+        self.assertEqual([frame], leaf.layout.free_frames)
+        self.assertEqual(0, isheval('(def count-down (fn [n] (if (eq n 0) n (count-down (subtract n 1))))) (count-down 1000)', scope))
+        self.assertLessEqual(len(isheval('count-down', scope).layout.free_frames), 2)
+    def test_captured_frames_are_not_recycled(self):
+        scope = Scope({}, root)
+        self.assertEqual(Pair(1, Pair(2, Pair(1, Pair(2, Pair(Pair(4, Pair(6, nil)), nil))))), isheval('''
+            (def make (fn [x] (fn - x)))
+            (def lazy (fn [x] (delay x)))
+            (def evens-from (fn [n] (stream-filter even? (range n 100))))
+            (a = (make 1))
+            (b = (make 2))
+            (c = (lazy 1))
+            (d = (lazy 2))
+            (e = (evens-from 3))
+            (evens-from 50)
+            [(a) (b) (force c) (force d) (stream-list (take 2 e))]''', scope))
+    def test_recycled_frames_start_empty(self):
+        scope = Scope({}, root)
+        isheval('(def remember (fn [first] (if first (def remembered 5) remembered)))', scope)
+        self.assertEqual(5, isheval('(remember true)', scope))
+        self.assertRaises(Exception, isheval, '(remember false)', scope)
+
     # test promises
 
     def test_promises(self):
@@ -689,6 +1277,136 @@ class Tests(unittest.TestCase):
             (d = x)
             a:b:c:d'''))
 
+    def test_promises_track_whether_theyve_been_forced(self):
+        promise = isheval('(delay void)')
+        self.assertFalse(promise.forced)
+        self.assertEqual(void, promise.get_value())
+        self.assertTrue(promise.forced)
+        self.assertEqual(void, promise.get_value())
+
+    def test_forcing_promise_chains(self):
+        self.assertEqual(7, isheval('(force (delay (delay (delay 7))))'))
+        promise = Promise.lazy(lambda: 'end')
+        for _ in range(100000):
+            promise = Promise.lazy(lambda promise = promise: promise)
+        self.assertEqual('end', promise.get_value())
+
+    def test_forcing_a_failed_promise_chain_again(self):
+        scope = Scope({}, root)
+        isheval('(def failing (delay (delay (car 5))))', scope)
+        for _ in range(2):
+            with self.assertRaises(AttributeError):
+                isheval('(force failing)', scope)
+        evaluated = []
+        def flaky():
+            evaluated.append(len(evaluated))
+            if len(evaluated) == 1:
+                raise ValueError('not yet')
+            return 'done'
+        last = Promise.lazy(flaky)
+        first = Promise.lazy(lambda: last)
+        with self.assertRaises(ValueError):
+            first.get_value()
+        self.assertFalse(first.forced)
+        self.assertEqual('done', first.get_value())
+        self.assertEqual([0, 1], evaluated)
+        self.assertTrue(last.forced)
+    def test_forcing_a_promise_cycle_raises(self):
+        scope = Scope({}, root)
+        isheval('(def self-promise (delay self-promise)) (def cycle-a (delay cycle-b)) (def cycle-b (delay cycle-a))', scope)
+        for code in ['(force self-promise)', '(force self-promise)', '(force cycle-a)', '(force cycle-b)']:
+            self.assertRaises(Exception, isheval, code, scope)
+
+    # test streams
+
+    def test_streams(self):
+        self.assertEqual(Pair(2, Pair(4, Pair(6, nil))),
+            isheval('(stream-list (take 3 (stream-filter even? (stream-map (fn [x] (add x 1)) (range)))))'))
+        self.assertEqual(Pair(200000, Pair(200002, nil)),
+            isheval('(stream-list (take 2 (drop 100000 (iterate (fn [x] (add x 2)) 0))))'))
+        self.assertEqual(Pair(10, Pair(7, Pair(4, Pair(1, nil)))), isheval('(stream-list (range 10 0 (subtract 0 3)))'))
+        self.assertEqual(Pair(1, Pair(2, nil)), isheval('(stream-list (stream-map id [1 2]))'))
+        self.assertEqual(nil, isheval('(stream-list (range 5 5))'))
+
+    def test_streams_are_lazy(self):
+        count = 0
+        def increment_count(args, scope):
+            nonlocal count
+            count += 1
+            return args.car
+        scope = Scope({'inc': increment_count}, root)
+        stream = isheval('(stream-map inc (range))', scope)
+        self.assertEqual(1, count)
+        self.assertEqual(1, stream.get(Pair(IdentifierNode('cdr'), nil), scope).car)
+        self.assertEqual(2, count)
+
+    def test_streams_bridge_python_iterators(self):
+        pulled = []
+        def numbers():
+            for n in itertools.count():
+                pulled.append(n)
+                yield n
+        stream = streams.from_iterable(numbers())
+        self.assertEqual([0], pulled)
+        self.assertEqual([0, 1, 2], list(itertools.islice(streams.iterate_stream(stream), 3)))
+        self.assertEqual([0, 1, 2], pulled)
+        self.assertEqual(Pair(20, nil), isheval('(stream-list (take 1 (stream-filter (fn [x] (eq x 20)) stream)))',
+            Scope({'stream': stream}, root)))
+        self.assertEqual(['a', 'b'], list(streams.iterate_stream(streams.from_iterable('ab'))))
+
+    def test_file_builtins(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'source.txt')
+            copy = os.path.join(directory, 'copy.txt')
+            scope = Scope({'source': source, 'copy': copy}, root)
+            isheval('(write-lines source (stream-map (fn [n] (add n n)) (range 1 4)))', scope)
+            self.assertEqual('2\n4\n6\n', isheval('(read-file source)', scope))
+            self.assertEqual(Pair('2', Pair('4', Pair('6', nil))), isheval('(stream-list (read-lines source))', scope))
+            isheval('(write-lines copy (read-lines source))', scope)
+            self.assertEqual('2\n4\n6\n', isheval('(read-file copy)', scope))
+            isheval('(write-file copy (read-file source))', scope)
+            self.assertEqual('2\n4\n6\n', isheval('(read-file copy)', scope))
+            with open(source, 'w', newline = '') as f:
+                f.write('a\r\n\nb')
+            self.assertEqual(['a', '', 'b'], list(streams.iterate_stream(isheval('(read-lines source)', scope))))
+            open(source, 'w').close()
+            self.assertEqual(nil, isheval('(read-lines source)', scope))
+
+    def test_read_lines_is_lazy(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'lines.txt')
+            with open(path, 'w') as f:
+                f.write('first\nsecond\n')
+            stream = isheval('(read-lines path)', Scope({'path': path}, root))
+            self.assertEqual('first', stream.car)
+            self.assertEqual(Promise, type(stream.cdr))
+            self.assertFalse(stream.cdr.forced)
+            self.assertEqual(Pair('second', nil), streams.to_list(streams.rest(stream)))
+    def test_read_lines_closes_abandoned_streams(self):
+        if not os.path.isdir('/proc/self/fd'):
+            return
+        def open_files():
+            return sum(1 for fd in os.listdir('/proc/self/fd') if os.path.realpath('/proc/self/fd/' + fd) == os.path.realpath(path))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'lines.txt')
+            with open(path, 'w') as f:
+                f.write('first\nsecond\nthird\n')
+            enabled = gc.isenabled()
+            gc.disable()
+            try:
+                stream = streams.file_lines(path)
+                self.assertEqual('second', streams.rest(stream).car)
+                self.assertGreater(open_files(), 0)
+                del stream
+                self.assertEqual(0, open_files())
+            finally:
+                if enabled:
+                    gc.enable()
+
+    def test_runtime_values_are_slotted(self):
+        for value in [Pair(1, nil), Symbol('foo'), isheval('(delay 1)'), read_one('(a b)'), read_one('a'), read_one('1'), isheval('(pattern [a | b])')]:
+            self.assertFalse(hasattr(value, '__dict__'), value)
+
     # test multifunctions
 
     def test_multi_functions(self):
@@ -698,5 +1416,64 @@ class Tests(unittest.TestCase):
             ([a b] (add a b))
         ))
         (multi-test 10):(multi-test 10 20)'''))
+    def test_failed_matches_format_errors_lazily(self):
+        reprs = 0
+        class Counted:
+            def __repr__(self):
+                nonlocal reprs
+                reprs += 1
+                return 'counted'
+        scope = Scope({'counted': Counted()}, root)
+        self.assertEqual(2, isheval('((mfn ([1] 1) ([a b] 3) ([a] 2)) counted)', scope))
+        self.assertEqual(0, reprs)
+        try:
+            isheval('((fn [a b] a) counted)', scope)
+            self.fail()
+        except PatternMatchError as e:
+            self.assertEqual(0, reprs)
+            self.assertEqual("pattern did not match. pattern: '(ConsPattern (IdentifierPattern a) (ConsPattern (IdentifierPattern b) (ValuePattern nil)))' actual: '(Pair counted nil)'", str(e))
+            self.assertEqual(1, reprs)
+        self.assertRaises(NoMatchingClauseError, isheval, '((mfn ([1] 1)) counted)', scope)
+        self.assertRaises(PatternMatchError, isheval, '((pattern 1) counted)', scope)
+        self.assertEqual(1, reprs)
+    def test_multi_functions_evaluate_arguments_once(self):
+        self.assertEqual(Pair(7, 1), isheval('''
+            (count = 0)
+            (next = (fn - (count = (add count 1)) count))
+            (def multi (mfn
+                ([a b c] 0)
+                ([a b] 1)
+                ([a] (add a 6))))
+            (multi (next)):count'''))
+    def test_multi_functions_dispatch_on_literals(self):
+        self.assertEqual(Pair(5, Pair(1, Pair(12, 6))), isheval('''
+            (def calc (mfn
+                ([#add a b] (add a b))
+                ([#sub a b] (subtract a b))
+                ([#neg a] (subtract 0 a))
+                ([[] a] a)
+                ([x:xs a] (add x a))
+                ([op | rest] 6)))
+            (calc #add 2 3):(calc #sub 3 2):(calc [10 11] 2):(calc #mul 1 2)'''))
+        self.assertRaises(Exception, isheval, '((mfn ([#a] 1)) #b)')
+    def test_dispatch_index(self):
+        mfn = isheval('''(mfn
+            ([0] 0)
+            ([1] 1)
+            ([n] 2)
+            ([a b] 3)
+            ([a b = 2] 4)
+            ([x:xs | rest] 5)
+            (- 6))''')
+        self.assertEqual((0, 2, 4, 6), mfn.index.candidates(isheval('[0]')))
+        self.assertEqual((2, 4, 6), mfn.index.candidates(isheval('[7]')))
+        self.assertEqual((2, 4, 5, 6), mfn.index.candidates(isheval('[[7]]')))
+        self.assertEqual((3, 4, 5, 6), mfn.index.candidates(isheval('[[7] 8]')))
+        self.assertEqual((5, 6), mfn.index.candidates(isheval('[[7] 8 9]')))
+        self.assertEqual((6,), mfn.index.candidates(isheval('[7 8 9]')))
+        self.assertEqual(mfn.index.all, mfn.index.candidates(isheval('1:2')))
+        self.assertEqual(Pair(1, Pair(Symbol('other'), nil)), isheval('''
+            (def literal-rest (mfn ((cons a (id [2 3])) a) (x #other)))
+            [(literal-rest 1 2 3) (literal-rest 1 2)]'''))
 
 unittest.main()